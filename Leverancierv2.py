@@ -1,8 +1,5 @@
 import streamlit as st
-import requests
-import json
 import pandas as pd
-import sqlite3
 import time
 import smtplib
 import secrets
@@ -10,13 +7,26 @@ import datetime
 import base64
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from threading import Thread
 import os
 from dotenv import load_dotenv
+from ultimo_client import get_client
+from portal_db import db_connection, ensure_schema, read_model, bump_generation, build_job_document
+from job_outbox import (
+    queue_completion, queue_completions, dispatch_completions, load_recent_completions, start_outbox_dispatcher
+)
+from job_attachments import prepare_attachments, upload_attachments
+from leveranciers_sync import (
+    trigger_sync, get_sync_status, get_sync_wakeup, start_sync_thread,
+    get_status_catalog, refresh_status_catalog, invalidate_status_catalog,
+    DEFAULT_PAGE_SIZE, MIN_PAGE_SIZE, MAX_PAGE_SIZE
+)
 
 # Load environment variables
 load_dotenv()
 
+JOB_PAGE_SIZE = int(os.getenv("JOB_PAGE_SIZE", "50"))
+SUPPLIER_PAGE_SIZE = int(os.getenv("SUPPLIER_PAGE_SIZE", "50"))
+
 # Add pandas options to avoid SettingWithCopyWarning
 pd.options.mode.copy_on_write = True
 
@@ -41,112 +51,11 @@ st.set_page_config(
 # Load modern CSS
 load_css()
 
-# Database setup with migration support
-def init_db():
-    conn = sqlite3.connect('leveranciers_portal.db')
-    c = conn.cursor()
-    
-    # Maak klanten tabel (Ultimo ERP systemen)
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS klanten (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        naam TEXT NOT NULL,
-        domein TEXT NOT NULL,
-        api_key TEXT NOT NULL
-    )
-    ''')
-    
-    # Maak voortgangsstatus-toewijzingen tabel
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS status_toewijzingen (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        klant_id INTEGER NOT NULL,
-        van_status TEXT NOT NULL,
-        naar_status TEXT NOT NULL,
-        FOREIGN KEY (klant_id) REFERENCES klanten (id)
-    )
-    ''')
-    
-    # Maak jobs cache tabel
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS jobs_cache (
-        id TEXT PRIMARY KEY,
-        klant_id INTEGER NOT NULL,
-        omschrijving TEXT NOT NULL,
-        apparatuur_omschrijving TEXT,
-        processfunctie_omschrijving TEXT,
-        voortgang_status TEXT NOT NULL,
-        leverancier_id TEXT NOT NULL,
-        wijzigingsdatum TEXT NOT NULL,
-        data JSON NOT NULL,
-        FOREIGN KEY (klant_id) REFERENCES klanten (id)
-    )
-    ''')
-    
-    # Maak inlogcodes tabel
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS inlogcodes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        email TEXT NOT NULL,
-        code TEXT NOT NULL,
-        aangemaakt_op TEXT NOT NULL,
-        gebruikt BOOLEAN NOT NULL DEFAULT 0
-    )
-    ''')
-    
-    # Maak email verificatie cache tabel
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS email_verification_cache (
-        email TEXT PRIMARY KEY,
-        verified BOOLEAN NOT NULL,
-        timestamp TEXT NOT NULL
-    )
-    ''')
-    
-    # Maak sync control tabel (backwards compatible)
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS sync_control (
-        id INTEGER PRIMARY KEY,
-        force_sync BOOLEAN NOT NULL DEFAULT 0,
-        last_sync TEXT,
-        sync_interval INTEGER NOT NULL DEFAULT 3600
-    )
-    ''')
-    
-    # Database migration: Add sync_in_progress column if it doesn't exist
-    try:
-        c.execute("SELECT sync_in_progress FROM sync_control LIMIT 1")
-    except sqlite3.OperationalError:
-        # Column doesn't exist, add it
-        print("Adding sync_in_progress column to sync_control table...")
-        c.execute("ALTER TABLE sync_control ADD COLUMN sync_in_progress BOOLEAN NOT NULL DEFAULT 0")
-    
-    # Voeg standaard sync instellingen toe als ze nog niet bestaan
-    c.execute("SELECT COUNT(*) FROM sync_control")
-    if c.fetchone()[0] == 0:
-        c.execute("INSERT INTO sync_control (id, force_sync, last_sync, sync_interval, sync_in_progress) VALUES (1, 0, NULL, 3600, 0)")
-    else:
-        # Update existing record to have sync_in_progress if it's missing
-        try:
-            c.execute("UPDATE sync_control SET sync_in_progress = 0 WHERE id = 1 AND sync_in_progress IS NULL")
-        except sqlite3.OperationalError:
-            # Column might still not exist in some edge cases
-            pass
-    
-    conn.commit()
-    conn.close()
-
 # API functions (keeping essential ones, same as original)
 def test_api_connection(domein, api_key):
     """Test de verbinding met de Ultimo API en geef gedetailleerde foutinformatie terug"""
     try:
-        url = f"https://{domein}/api/v1/object/ProgressStatus"
-        headers = {
-            "accept": "application/json",
-            "ApiKey": api_key
-        }
-        
-        response = requests.get(url, headers=headers, timeout=10)
+        response = get_client(domein, api_key).get("object/ProgressStatus", timeout=10)
         if response.status_code == 200:
             return True, "Verbinding succesvol"
         else:
@@ -159,68 +68,6 @@ def test_api_connection(domein, api_key):
     except Exception as e:
         return False, f"Uitzondering: {str(e)}"
 
-def get_progress_statuses(domein, api_key):
-    url = f"https://{domein}/api/v1/object/ProgressStatus"
-    headers = {
-        "accept": "application/json",
-        "ApiKey": api_key
-    }
-    
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            return response.json().get("items", [])
-        else:
-            st.error(f"Fout bij het ophalen van voortgangsstatussen: {response.status_code}")
-            return []
-    except Exception as e:
-        st.error(f"Fout bij verbinding met API: {str(e)}")
-        return []
-
-def update_job_status(domein, api_key, job_id, voortgang_status, feedback_tekst):
-    url = f"https://{domein}/api/v1/object/Job('{job_id}')"
-    
-    headers = {
-        "accept": "application/json",
-        "Content-Type": "application/json",
-        "ApiKey": api_key
-    }
-    
-    max_feedback_length = 2000
-    if feedback_tekst and len(feedback_tekst) > max_feedback_length:
-        feedback_tekst = feedback_tekst[:max_feedback_length]
-    
-    data = {
-        "ProgressStatus": voortgang_status,
-        "RecordStatus": "016"  # Zet RecordStatus naar 016
-    }
-    
-    if feedback_tekst and feedback_tekst.strip():
-        data["FeedbackText"] = feedback_tekst
-    
-    try:
-        response = requests.patch(url, headers=headers, json=data)
-        
-        if response.status_code == 204 or response.status_code == 200:
-            return True
-        else:
-            error_message = f"Fout bij het bijwerken van job: {response.status_code}"
-            try:
-                error_details = response.json()
-                error_message += f" - {json.dumps(error_details)}"
-            except:
-                error_message += f" - {response.text[:200]}"
-            
-            print(error_message)
-            st.error(f"Fout bij het bijwerken van job: {response.status_code}")
-            return False
-    except Exception as e:
-        error_message = f"Exception bij het bijwerken van job: {str(e)}"
-        print(error_message)
-        st.error("Onverwachte fout bij het bijwerken van de job")
-        return False
-
-# Email functions (simplified for demo)
 def generate_login_code(email):
     code = secrets.token_hex(3).upper()
     now = datetime.datetime.now().isoformat()
@@ -228,12 +75,9 @@ def generate_login_code(email):
     st.session_state["last_code"] = code
     
     try:
-        conn = sqlite3.connect('leveranciers_portal.db')
-        c = conn.cursor()
-        c.execute("INSERT INTO inlogcodes (email, code, aangemaakt_op) VALUES (?, ?, ?)",
-                  (email, code, now))
-        conn.commit()
-        conn.close()
+        with db_connection() as conn:
+            conn.execute("INSERT INTO inlogcodes (email, code, aangemaakt_op) VALUES (?, ?, ?)",
+                         (email, code, now))
     except Exception as e:
         st.error(f"Database fout: {str(e)}")
         return False
@@ -245,25 +89,21 @@ def verify_login_code(email, code):
         return True
         
     try:
-        conn = sqlite3.connect('leveranciers_portal.db')
-        c = conn.cursor()
-        
         fifteen_min_ago = (datetime.datetime.now() - datetime.timedelta(minutes=15)).isoformat()
         
-        c.execute("""
-        SELECT id FROM inlogcodes 
-        WHERE email = ? AND code = ? AND aangemaakt_op > ? AND gebruikt = 0
-        ORDER BY aangemaakt_op DESC LIMIT 1
-        """, (email, code, fifteen_min_ago))
-        
-        result = c.fetchone()
-        
-        if result:
-            c.execute("UPDATE inlogcodes SET gebruikt = 1 WHERE id = ?", (result[0],))
-            conn.commit()
-            conn.close()
-            return True
-        conn.close()
+        with db_connection() as conn:
+            c = conn.cursor()
+            c.execute("""
+            SELECT id FROM inlogcodes 
+            WHERE email = ? AND code = ? AND aangemaakt_op > ? AND gebruikt = 0
+            ORDER BY aangemaakt_op DESC LIMIT 1
+            """, (email, code, fifteen_min_ago))
+            
+            result = c.fetchone()
+            
+            if result:
+                c.execute("UPDATE inlogcodes SET gebruikt = 1 WHERE id = ?", (result[0],))
+                return True
     except Exception as e:
         print(f"Verificatie fout: {str(e)}")
             
@@ -274,266 +114,190 @@ def check_email_exists(email):
         return True
         
     try:
-        conn = sqlite3.connect('leveranciers_portal.db')
-        c = conn.cursor()
-        
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS email_verification_cache (
-            email TEXT PRIMARY KEY,
-            verified BOOLEAN NOT NULL,
-            timestamp TEXT NOT NULL
-        )
-        """)
-        
-        one_day_ago = (datetime.datetime.now() - datetime.timedelta(days=1)).isoformat()
-        c.execute("""
-        SELECT verified FROM email_verification_cache
-        WHERE email = ? AND timestamp > ?
-        """, (email, one_day_ago))
-        
-        result = c.fetchone()
-        if result is not None:
-            conn.close()
-            return result[0]
-        
-        c.execute("""
-        SELECT COUNT(*) FROM jobs_cache
-        WHERE json_extract(data, '$.Vendor.ObjectContacts') IS NOT NULL
-        """)
-        
-        c.execute("""
-        SELECT data FROM jobs_cache
-        WHERE json_extract(data, '$.Vendor.ObjectContacts') IS NOT NULL
-        """)
-        
-        jobs = c.fetchall()
-        
-        email_found = False
-        for job in jobs:
-            data = json.loads(job[0])
-            if 'Vendor' in data and data['Vendor'] is not None and 'ObjectContacts' in data['Vendor']:
-                for contact in data['Vendor']['ObjectContacts']:
-                    if 'Employee' in contact and contact['Employee'] is not None:
-                        employee = contact['Employee']
-                        if 'EmailAddress' in employee and employee['EmailAddress'] == email:
-                            email_found = True
-                            break
-                if email_found:
-                    break
-        
-        now = datetime.datetime.now().isoformat()
-        c.execute("""
-        INSERT OR REPLACE INTO email_verification_cache (email, verified, timestamp)
-        VALUES (?, ?, ?)
-        """, (email, email_found, now))
-        conn.commit()
-        conn.close()
-        
-        return email_found
+        # Positieve en negatieve antwoorden komen uit de in-memory set, zonder query op job_contacts
+        return email in load_known_emails()
     except Exception as e:
         print(f"Error checking email: {str(e)}")
         return False
 
-# IMPROVED SYNC SYSTEM - Single consolidated function
-def trigger_sync():
-    """Improved sync trigger that doesn't require re-login"""
-    try:
-        conn = sqlite3.connect('leveranciers_portal.db')
-        c = conn.cursor()
-        
-        # Check if sync is already in progress
-        c.execute("SELECT sync_in_progress FROM sync_control WHERE id = 1")
-        result = c.fetchone()
-        
-        if result and result[0]:
-            conn.close()
-            return False, "Sync already in progress"
-        
-        # Set sync in progress and force sync flags
-        c.execute("UPDATE sync_control SET force_sync = 1, sync_in_progress = 1 WHERE id = 1")
-        conn.commit()
-        conn.close()
-        return True, "Sync started"
-    except Exception as e:
-        return False, f"Error starting sync: {str(e)}"
+# READ MODELS - Cached per generation, reloaded after sync or admin changes
+@read_model
+def load_klanten(conn):
+    """Alle klanten als (id, naam, domein, api_key)"""
+    return conn.execute("SELECT id, naam, domein, api_key FROM klanten").fetchall()
 
-def get_sync_status():
-    """Get current sync status without triggering a rerun"""
-    try:
-        conn = sqlite3.connect('leveranciers_portal.db')
-        c = conn.cursor()
-        
-        c.execute("SELECT sync_in_progress, last_sync, sync_interval FROM sync_control WHERE id = 1")
-        result = c.fetchone()
-        
-        if result:
-            sync_in_progress, last_sync, sync_interval = result
-            conn.close()
-            return {
-                'in_progress': bool(sync_in_progress),
-                'last_sync': last_sync,
-                'interval': sync_interval
-            }
-        
-        conn.close()
-        return {'in_progress': False, 'last_sync': None, 'interval': 3600}
-    except:
-        return {'in_progress': False, 'last_sync': None, 'interval': 3600}
+@read_model
+def load_klanten_df(conn):
+    return pd.read_sql_query("SELECT id, naam, domein, api_key FROM klanten", conn)
 
-# IMPROVED SYNC THREAD - Better session state handling
-def sync_jobs():
-    while True:
-        try:
-            now = datetime.datetime.now()
-            now_str = now.strftime("%Y-%m-%d %H:%M:%S")
-            
-            conn = sqlite3.connect('leveranciers_portal.db')
-            c = conn.cursor()
-            
-            c.execute("SELECT force_sync, last_sync, sync_interval, sync_in_progress FROM sync_control WHERE id = 1")
-            result = c.fetchone()
-            
-            if result:
-                force_sync_flag, db_last_sync, sync_interval, sync_in_progress = result
-            else:
-                force_sync_flag = False
-                db_last_sync = None
-                sync_interval = 3600
-                sync_in_progress = False
-                c.execute("INSERT INTO sync_control (id, force_sync, last_sync, sync_interval, sync_in_progress) VALUES (1, 0, NULL, 3600, 0)")
-                conn.commit()
-            
-            should_sync = False
-            
-            if force_sync_flag:
-                should_sync = True
-                c.execute("UPDATE sync_control SET force_sync = 0 WHERE id = 1")
-                conn.commit()
-                print("Forced sync triggered")
-            elif db_last_sync is None:
-                should_sync = True
-                print("Initial sync")
-            else:
-                try:
-                    last_sync_time = datetime.datetime.fromisoformat(db_last_sync)
-                    time_since_last_sync = (now - last_sync_time).total_seconds()
-                    should_sync = time_since_last_sync >= sync_interval
-                    if should_sync:
-                        print(f"Regular sync triggered after {time_since_last_sync} seconds")
-                except Exception as e:
-                    print(f"Error parsing last sync time: {str(e)}")
-                    should_sync = True
-            
-            if should_sync:
-                # Set sync in progress
-                c.execute("UPDATE sync_control SET sync_in_progress = 1 WHERE id = 1")
-                conn.commit()
-                
-                # Perform sync logic here (same as original)
-                c.execute("SELECT id, naam, domein, api_key FROM klanten")
-                klanten = c.fetchall()
-                
-                for klant in klanten:
-                    klant_id, klant_naam, domein, api_key = klant
-                    
-                    c.execute("""
-                    SELECT MAX(wijzigingsdatum) FROM jobs_cache
-                    WHERE klant_id = ?
-                    """, (klant_id,))
-                    
-                    laatste_wijzigingsdatum = c.fetchone()[0]
-                    
-                    filter_query = None
-                    if laatste_wijzigingsdatum:
-                        try:
-                            parsed_date = datetime.datetime.fromisoformat(laatste_wijzigingsdatum.replace('Z', '+00:00'))
-                            formatted_date = parsed_date.strftime('%Y-%m-%dT%H:%M:%SZ')
-                            filter_query = f"RecordChangeDate gt {formatted_date}"
-                        except Exception as e:
-                            print(f"Fout bij het parsen van de datum: {str(e)}")
-                            filter_query = f"RecordChangeDate gt {laatste_wijzigingsdatum}"
-                    
-                    try:
-                        url = f"https://{domein}/api/v1/object/Job"
-                        params = {}
-                        if filter_query:
-                            params["filter"] = filter_query
-                        params["expand"] = "Vendor/ObjectContacts/Employee,Equipment,ProcessFunction"
-                        
-                        headers = {
-                            "accept": "application/json",
-                            "ApiKey": api_key
-                        }
-                        
-                        response = requests.get(url, headers=headers, params=params, timeout=10)
-                        if response.status_code != 200:
-                            print(f"API-fout voor klant {klant_id}: {response.status_code}")
-                            continue
-                            
-                        jobs = response.json().get("items", [])
-                        
-                        for job in jobs:
-                            job_id = job.get("Id", "")
-                            omschrijving = job.get("Description", "")
-                            voortgang_status = job.get("ProgressStatus", "")
-                            wijzigingsdatum = job.get("RecordChangeDate")
-                            
-                            if not wijzigingsdatum:
-                                wijzigingsdatum = now_str
-                            
-                            leverancier_id = ""
-                            if "Vendor" in job and isinstance(job["Vendor"], dict):
-                                leverancier_id = job["Vendor"].get("Id", "")
-                            
-                            apparatuur_omschrijving = ""
-                            if "Equipment" in job and isinstance(job["Equipment"], dict):
-                                apparatuur_omschrijving = job["Equipment"].get("Description", "")
-                            
-                            processfunctie_omschrijving = ""
-                            if "ProcessFunction" in job and isinstance(job["ProcessFunction"], dict):
-                                processfunctie_omschrijving = job["ProcessFunction"].get("Description", "")
-                            
-                            c.execute("""
-                            INSERT OR REPLACE INTO jobs_cache 
-                            (id, klant_id, omschrijving, apparatuur_omschrijving, 
-                            processfunctie_omschrijving, voortgang_status, leverancier_id, 
-                            wijzigingsdatum, data)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                            """, (
-                                job_id, klant_id, omschrijving, apparatuur_omschrijving,
-                                processfunctie_omschrijving, voortgang_status, leverancier_id,
-                                wijzigingsdatum, json.dumps(job)
-                            ))
-                    
-                    except Exception as e:
-                        print(f"Fout bij het verwerken van jobs voor klant {klant_id}: {str(e)}")
-                
-                # Update sync completion
-                c.execute("UPDATE sync_control SET last_sync = ?, sync_in_progress = 0 WHERE id = 1", (now_str,))
-                conn.commit()
-                print(f"Sync completed at {now_str}")
-            
-            conn.close()
-        
-        except Exception as e:
-            print(f"Sync thread fout: {str(e)}")
-            # Make sure to clear sync_in_progress flag on error
-            try:
-                conn = sqlite3.connect('leveranciers_portal.db')
-                c = conn.cursor()
-                c.execute("UPDATE sync_control SET sync_in_progress = 0 WHERE id = 1")
-                conn.commit()
-                conn.close()
-            except:
-                pass
-        
-        time.sleep(60)
+@read_model
+def load_known_emails(conn):
+    """Alle leveranciers e-mails met minstens één job; opnieuw opgebouwd zodra een sync commit"""
+    return frozenset(email for email, in conn.execute("SELECT DISTINCT email FROM job_contacts"))
 
-def start_sync_thread():
-    sync_thread = Thread(target=sync_jobs)
-    sync_thread.daemon = True
-    sync_thread.start()
-    print("Sync thread gestart")
+def like_pattern(zoekterm):
+    """LIKE patroon voor 'bevat'; % en _ in de zoekterm zijn gewone tekens (gebruik met ESCAPE '\\')"""
+    escaped = zoekterm.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+@read_model
+def load_status_mappings(conn, klant_id):
+    """Toewijzingen van een klant als {van_status: naar_status}"""
+    c = conn.cursor()
+    c.execute("""
+    SELECT van_status, naar_status FROM status_toewijzingen
+    WHERE klant_id = ?
+    """, (klant_id,))
+    return {van_status: naar_status for van_status, naar_status in c.fetchall()}
+
+@read_model
+def load_status_mappings_df(conn, klant_id):
+    return pd.read_sql_query("""
+    SELECT id, van_status, naar_status FROM status_toewijzingen
+    WHERE klant_id = ?
+    """, conn, params=(klant_id,))
+
+@read_model
+def load_supplier_overview(conn, email):
+    """Per klant het aantal jobs en verwerkbare jobs van een leverancier"""
+    c = conn.cursor()
+    c.execute("""
+    SELECT jc.klant_id, k.naam, COUNT(*) AS totaal,
+           SUM(CASE WHEN st.van_status IS NOT NULL THEN 1 ELSE 0 END) AS verwerkbaar
+    FROM job_contacts ct
+    JOIN jobs_cache jc ON jc.id = ct.job_id AND jc.klant_id = ct.klant_id
+    JOIN klanten k ON jc.klant_id = k.id
+    LEFT JOIN (SELECT DISTINCT klant_id, van_status FROM status_toewijzingen) st
+           ON st.klant_id = jc.klant_id AND st.van_status = jc.voortgang_status
+    WHERE ct.email = ?
+    GROUP BY jc.klant_id, k.naam
+    ORDER BY k.naam
+    """, (email,))
+    return c.fetchall()
+
+@read_model
+def load_supplier_jobs_page(conn, email, klant_id, zoekterm, alleen_verwerkbaar, limit, offset):
+    """Eén pagina jobs van een leverancier bij een klant; geeft (jobs, totaal) terug"""
+    where = ["ct.email = ?", "ct.klant_id = ?"]
+    params = [email, klant_id]
+    
+    if alleen_verwerkbaar:
+        where.append("jc.voortgang_status IN (SELECT van_status FROM status_toewijzingen WHERE klant_id = ?)")
+        params.append(klant_id)
+    
+    if zoekterm:
+        where.append("(jc.id LIKE ? ESCAPE '\\' OR jc.omschrijving LIKE ? ESCAPE '\\' "
+                     "OR jc.apparatuur_omschrijving LIKE ? ESCAPE '\\')")
+        params.extend([like_pattern(zoekterm)] * 3)
+    
+    from_clause = f"""
+    FROM job_contacts ct
+    JOIN jobs_cache jc ON jc.id = ct.job_id AND jc.klant_id = ct.klant_id
+    WHERE {" AND ".join(where)}
+    """
+    
+    c = conn.cursor()
+    c.execute(f"SELECT COUNT(*) {from_clause}", params)
+    totaal = c.fetchone()[0]
+    
+    c.execute(f"""
+    SELECT jc.id, jc.omschrijving, jc.apparatuur_omschrijving,
+           jc.processfunctie_omschrijving, jc.voortgang_status
+    {from_clause}
+    ORDER BY jc.id
+    LIMIT ? OFFSET ?
+    """, params + [limit, offset])
+    
+    jobs = [
+        {
+            "id": job_id,
+            "omschrijving": omschrijving,
+            "apparatuur_omschrijving": app_desc,
+            "processfunctie_omschrijving": proc_func_desc,
+            "voortgang_status": voortgang_status
+        }
+        for job_id, omschrijving, app_desc, proc_func_desc, voortgang_status in c.fetchall()
+    ]
+    return jobs, totaal
+
+@read_model
+def load_job_document(conn, klant_id, job_id):
+    """Volledig job document van één job, opnieuw opgebouwd uit jobs_cache en referenties"""
+    return build_job_document(conn, klant_id, job_id)
+
+@read_model
+def load_supplier_directory(conn, klant_id, zoekterm, limit, offset):
+    """Eén pagina leveranciers e-mails met aantallen, gegroepeerd in SQL; geeft (rijen, totaal) terug.
+    
+    `klant_id` 0 betekent alle klanten. De zoekterm matcht op e-mail, naam of leverancier;
+    een e-mail blijft met al zijn jobs meetellen zodra één van de rijen matcht.
+    """
+    where, params = "", []
+    if klant_id:
+        where = "WHERE ct.klant_id = ?"
+        params.append(klant_id)
+    
+    having, having_params = "", []
+    if zoekterm:
+        having = """
+        HAVING MAX(ct.email LIKE ? ESCAPE '\\' OR ct.naam LIKE ? ESCAPE '\\' OR ct.leverancier_id LIKE ? ESCAPE '\\'
+                   OR json_extract(v.data, '$.Description') LIKE ? ESCAPE '\\')
+        """
+        having_params = [like_pattern(zoekterm)] * 4
+    
+    grouped = f"""
+    SELECT ct.email, MAX(ct.naam) AS naam, COUNT(*) AS aantal_jobs,
+           GROUP_CONCAT(DISTINCT ct.leverancier_id || COALESCE(': ' || json_extract(v.data, '$.Description'), '')) AS leveranciers,
+           GROUP_CONCAT(DISTINCT k.naam) AS klanten
+    FROM job_contacts ct
+    JOIN klanten k ON k.id = ct.klant_id
+    LEFT JOIN referenties v ON v.klant_id = ct.klant_id AND v.entiteit = 'Vendor' AND v.id = ct.leverancier_id
+    {where}
+    GROUP BY ct.email
+    {having}
+    """
+    params += having_params
+    
+    c = conn.cursor()
+    c.execute(f"SELECT COUNT(*) FROM ({grouped})", params)
+    totaal = c.fetchone()[0]
+    
+    c.execute(f"{grouped} ORDER BY ct.email LIMIT ? OFFSET ?", params + [limit, offset])
+    return c.fetchall(), totaal
+
+@read_model
+def load_contact_jobs(conn, email, klant_id, limit):
+    """De eerste `limit` jobs van een leveranciers e-mail (`klant_id` 0 = alle klanten)"""
+    query = """
+    SELECT jc.id, jc.omschrijving, k.naam
+    FROM job_contacts ct
+    JOIN jobs_cache jc ON jc.id = ct.job_id AND jc.klant_id = ct.klant_id
+    JOIN klanten k ON k.id = ct.klant_id
+    WHERE ct.email = ?
+    """
+    params = [email]
+    if klant_id:
+        query += " AND ct.klant_id = ?"
+        params.append(klant_id)
+    
+    return conn.execute(query + " ORDER BY k.naam, jc.id LIMIT ?", params + [limit]).fetchall()
+
+def display_pager(key, page, page_count, caption):
+    """Vorige/volgende knoppen; het paginanummer staat in st.session_state[key]"""
+    if page_count <= 1:
+        return
+    
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("⬅️ Vorige", disabled=page == 0, key=f"{key}_prev", use_container_width=True):
+            st.session_state[key] = page - 1
+            st.rerun()
+    with col2:
+        st.caption(f"Pagina {page + 1} van {page_count} ({caption})")
+    with col3:
+        if st.button("Volgende ➡️", disabled=page >= page_count - 1, key=f"{key}_next", use_container_width=True):
+            st.session_state[key] = page + 1
+            st.rerun()
 
 # MODERN SYNC STATUS DISPLAY
 def display_sync_status():
@@ -837,6 +601,29 @@ def login_page():
     """, unsafe_allow_html=True)
 
 # MODERN SUPPLIER PAGE
+def display_completion_status(email):
+    """Toon de verzendstatus van de laatste afrondingen van deze leverancier"""
+    # Meldingen van de vorige inzending, bewaard over de rerun heen
+    for kind, message in st.session_state.pop("completion_flash", []):
+        getattr(st, kind)(message)
+    
+    completions = load_recent_completions(email)
+    if not completions:
+        return
+    
+    status_labels = {
+        "wachtend": "⏳ In wachtrij",
+        "bezig": "📤 Wordt verstuurd",
+        "verzonden": "✅ Verstuurd",
+        "mislukt": "❌ Mislukt"
+    }
+    open_count = sum(1 for row in completions if row[3] in ("wachtend", "bezig"))
+    
+    with st.expander(f"📨 Recente afrondingen ({open_count} in behandeling)", expanded=open_count > 0):
+        df = pd.DataFrame(completions, columns=["Werkorder", "Klant", "Naar Status", "Status", "Pogingen", "Laatste Fout", "Ingediend"])
+        df["Status"] = df["Status"].map(lambda x: status_labels.get(x, x))
+        st.dataframe(df, use_container_width=True, hide_index=True)
+
 def supplier_page():
     # Header
     st.markdown("""
@@ -855,126 +642,61 @@ def supplier_page():
     # Get user jobs
     email = st.session_state.get("user_email")
     
-    conn = sqlite3.connect('leveranciers_portal.db')
-    c = conn.cursor()
+    # Aantallen per klant; de jobs zelf worden per pagina opgehaald
+    overview = load_supplier_overview(email)
     
-    try:
-        c.execute("""
-        SELECT jc.id, jc.klant_id, k.naam as klant_naam, jc.omschrijving, 
-               jc.apparatuur_omschrijving, jc.processfunctie_omschrijving, 
-               jc.voortgang_status, jc.data
-        FROM jobs_cache jc
-        JOIN klanten k ON jc.klant_id = k.id
-        """)
-        
-        all_jobs = c.fetchall()
-        
-        # Filter jobs for this user
-        jobs = []
-        for job in all_jobs:
-            job_id, klant_id, klant_naam, omschrijving, app_desc, proc_func_desc, voortgang_status, data_json = job
-            data = json.loads(data_json)
-            
-            if 'Vendor' in data and data['Vendor'] is not None and 'ObjectContacts' in data['Vendor']:
-                for contact in data['Vendor']['ObjectContacts']:
-                    if 'Employee' in contact and contact['Employee'] is not None:
-                        employee = contact['Employee']
-                        if 'EmailAddress' in employee and employee['EmailAddress'] == email:
-                            jobs.append(job)
-                            break
+    if not overview:
+        st.markdown("""
+        <div class="modern-card">
+            <div style="text-align: center; padding: 2rem;">
+                <h3>📭 Geen werkorders gevonden</h3>
+                <p>Er zijn momenteel geen werkorders toegewezen aan uw account.</p>
+                <p><em>Probeer de gegevens te synchroniseren of neem contact op met uw beheerder.</em></p>
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
+        return
+    
+    # Display statistics
+    with st.container():
+        st.markdown('<div class="modern-card"><h3>📊 Overzicht</h3></div>', unsafe_allow_html=True)
+        total_jobs = sum(row[2] for row in overview)
+        processable_count = sum(row[3] for row in overview)
         
-        if not jobs:
-            st.markdown("""
-            <div class="modern-card">
-                <div style="text-align: center; padding: 2rem;">
-                    <h3>📭 Geen werkorders gevonden</h3>
-                    <p>Er zijn momenteel geen werkorders toegewezen aan uw account.</p>
-                    <p><em>Probeer de gegevens te synchroniseren of neem contact op met uw beheerder.</em></p>
-                </div>
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.markdown(f"""
+            <div class="metric-card">
+                <div class="metric-value">{total_jobs}</div>
+                <div class="metric-label">Totaal Werkorders</div>
             </div>
             """, unsafe_allow_html=True)
-            return
-        
-        # Group jobs by customer
-        jobs_by_customer = {}
-        jobs_data = {}
-        
-        for job in jobs:
-            job_id, klant_id, klant_naam, omschrijving, app_desc, proc_func_desc, voortgang_status, data = job
-            
-            if klant_id not in jobs_by_customer:
-                jobs_by_customer[klant_id] = []
-                
-            job_dict = {
-                "id": job_id,
-                "omschrijving": omschrijving,
-                "apparatuur_omschrijving": app_desc,
-                "processfunctie_omschrijving": proc_func_desc,
-                "voortgang_status": voortgang_status,
-                "klant_naam": klant_naam
-            }
-            
-            jobs_by_customer[klant_id].append(job_dict)
-            jobs_data[job_id] = json.loads(data)
         
-        # Get status mappings
-        customer_mappings = {}
-        for klant_id in jobs_by_customer.keys():
-            c.execute("""
-            SELECT van_status, naar_status FROM status_toewijzingen
-            WHERE klant_id = ?
-            """, (klant_id,))
-            
-            mappings = c.fetchall()
-            customer_mappings[klant_id] = {van_status: naar_status for van_status, naar_status in mappings}
+        with col2:
+            st.markdown(f"""
+            <div class="metric-card">
+                <div class="metric-value">{processable_count}</div>
+                <div class="metric-label">Te Verwerken</div>
+            </div>
+            """, unsafe_allow_html=True)
         
-        # Display statistics - ONLY if we have jobs
-        if jobs_by_customer:
-            with st.container():
-                st.markdown('<div class="modern-card"><h3>📊 Overzicht</h3></div>', unsafe_allow_html=True)
-                total_jobs = sum(len(jobs) for jobs in jobs_by_customer.values())
-                processable_count = 0
-                for klant_id, jobs_list in jobs_by_customer.items():
-                    for job in jobs_list:
-                        if job["voortgang_status"] in customer_mappings.get(klant_id, {}):
-                            processable_count += 1
-                
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.markdown(f"""
-                    <div class="metric-card">
-                        <div class="metric-value">{total_jobs}</div>
-                        <div class="metric-label">Totaal Werkorders</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                
-                with col2:
-                    st.markdown(f"""
-                    <div class="metric-card">
-                        <div class="metric-value">{processable_count}</div>
-                        <div class="metric-label">Te Verwerken</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                
-                with col3:
-                    st.markdown(f"""
-                    <div class="metric-card">
-                        <div class="metric-value">{len(jobs_by_customer)}</div>
-                        <div class="metric-label">Klanten</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-            
-            # Display customer tabs
-            customer_tabs = st.tabs([f"🏢 {jobs_by_customer[klant_id][0]['klant_naam']} ({len(jobs_by_customer[klant_id])})" 
-                                    for klant_id in jobs_by_customer.keys()])
-            
-            for i, (klant_id, jobs) in enumerate(jobs_by_customer.items()):
-                with customer_tabs[i]:
-                    display_customer_jobs_modern(klant_id, jobs, customer_mappings[klant_id], jobs_data)
+        with col3:
+            st.markdown(f"""
+            <div class="metric-card">
+                <div class="metric-value">{len(overview)}</div>
+                <div class="metric-label">Klanten</div>
+            </div>
+            """, unsafe_allow_html=True)
+    
+    display_completion_status(email)
     
-    finally:
-        conn.close()
+    # Display customer tabs
+    customer_tabs = st.tabs([f"🏢 {klant_naam} ({totaal})" for _, klant_naam, totaal, _ in overview])
     
+    for i, (klant_id, _, totaal, verwerkbaar) in enumerate(overview):
+        with customer_tabs[i]:
+            display_customer_jobs_modern(klant_id, email, totaal, verwerkbaar, load_status_mappings(klant_id))
+
     # Modern footer
     st.markdown("""
     <div class="modern-footer">
@@ -982,13 +704,9 @@ def supplier_page():
     </div>
     """, unsafe_allow_html=True)
 
-def display_customer_jobs_modern(klant_id, jobs, mappings, jobs_data):
+def display_customer_jobs_modern(klant_id, email, totaal, verwerkbaar, mappings):
     """Modern job display with improved UI"""
-    conn = sqlite3.connect('leveranciers_portal.db')
-    c = conn.cursor()
-    c.execute("SELECT naam, domein, api_key FROM klanten WHERE id = ?", (klant_id,))
-    klant = c.fetchone()
-    conn.close()
+    klant = next((k[1:] for k in load_klanten() if k[0] == klant_id), None)
     
     if not klant:
         st.error("❌ Klantinformatie niet gevonden.")
@@ -996,21 +714,15 @@ def display_customer_jobs_modern(klant_id, jobs, mappings, jobs_data):
     
     klant_naam, domein, api_key = klant
     
-    if not jobs:
+    if not totaal:
         st.info("📭 Geen jobs gevonden voor deze klant.")
         return
     
-    # Get progress statuses
-    voortgang_statussen = get_progress_statuses(domein, api_key)
+    # Get progress statuses (lokale catalogus, geen Ultimo aanroep per rerun)
+    voortgang_statussen = get_status_catalog(klant_id, domein, api_key)
     status_mapping = {status["Id"]: status["Description"] for status in voortgang_statussen}
     
-    # Filter processable jobs
-    processable_jobs = []
-    for job in jobs:
-        if job["voortgang_status"] in mappings:
-            processable_jobs.append(job)
-    
-    if not processable_jobs:
+    if not verwerkbaar:
         st.markdown("""
         <div class="modern-card">
             <h4>⚠️ Geen verwerkbare werkorders</h4>
@@ -1018,8 +730,11 @@ def display_customer_jobs_modern(klant_id, jobs, mappings, jobs_data):
         </div>
         """, unsafe_allow_html=True)
         
-        # Show all jobs for reference
+        # Show jobs for reference (eerste pagina)
         with st.expander("📋 Alle toegewezen jobs bekijken"):
+            jobs, _ = load_supplier_jobs_page(email, klant_id, "", False, JOB_PAGE_SIZE, 0)
+            if totaal > len(jobs):
+                st.caption(f"Eerste {len(jobs)} van {totaal} jobs")
             for job in jobs:
                 status_desc = status_mapping.get(job["voortgang_status"], f"Onbekend ({job['voortgang_status']})")
                 st.markdown(f"""
@@ -1030,17 +745,45 @@ def display_customer_jobs_modern(klant_id, jobs, mappings, jobs_data):
                 """, unsafe_allow_html=True)
         return
     
-    st.success(f"✅ {len(processable_jobs)} werkorder(s) beschikbaar om te verwerken")
+    st.success(f"✅ {verwerkbaar} werkorder(s) beschikbaar om te verwerken")
+    
+    # Job selection - zoeken en bladeren gebeurt in SQL, niet in de selectbox
+    zoekterm = st.text_input("🔎 Zoek op ID, omschrijving of apparatuur:", key=f"job_search_{klant_id}").strip()
+    
+    page_key = f"job_page_{klant_id}"
+    if st.session_state.get(f"job_search_prev_{klant_id}") != zoekterm:
+        st.session_state[f"job_search_prev_{klant_id}"] = zoekterm
+        st.session_state[page_key] = 0
+    page = st.session_state.get(page_key, 0)
+    
+    processable_jobs, gevonden = load_supplier_jobs_page(email, klant_id, zoekterm, True, JOB_PAGE_SIZE, page * JOB_PAGE_SIZE)
+    page_count = max(1, -(-gevonden // JOB_PAGE_SIZE))
+    
+    # Na een sync kan de lijst korter zijn geworden dan de bewaarde pagina
+    if page >= page_count:
+        page = st.session_state[page_key] = page_count - 1
+        processable_jobs, gevonden = load_supplier_jobs_page(email, klant_id, zoekterm, True, JOB_PAGE_SIZE, page * JOB_PAGE_SIZE)
+    
+    if not processable_jobs:
+        st.info("🔎 Geen werkorders gevonden voor deze zoekopdracht.")
+        return
+    
+    display_pager(page_key, page, page_count, f"{gevonden} werkorders")
+    
+    jobs_by_id = {job["id"]: job for job in processable_jobs}
+    
+    if st.toggle("📦 Meerdere werkorders tegelijk afronden", key=f"bulk_mode_{klant_id}"):
+        display_bulk_completion(klant_id, email, jobs_by_id, mappings, status_mapping)
+        return
     
-    # Job selection
     selected_job_id = st.selectbox(
         "🎯 Selecteer een werkorder om te verwerken:",
-        [job["id"] for job in processable_jobs],
-        format_func=lambda x: next((f"{job['id']}: {job['omschrijving']} - {job['apparatuur_omschrijving'] or 'Geen apparatuur'}" 
-                                   for job in processable_jobs if job['id'] == x), x)
+        list(jobs_by_id.keys()),
+        format_func=lambda x: f"{x}: {jobs_by_id[x]['omschrijving']} - {jobs_by_id[x]['apparatuur_omschrijving'] or 'Geen apparatuur'}",
+        key=f"job_select_{klant_id}"
     )
     
-    selected_job = next((job for job in processable_jobs if job['id'] == selected_job_id), None)
+    selected_job = jobs_by_id.get(selected_job_id)
     
     if not selected_job:
         return
@@ -1064,6 +807,13 @@ def display_customer_jobs_modern(klant_id, jobs, mappings, jobs_data):
             **📊 Huidige Status:** 
             <span class="status-badge status-in-progress">{status_id}: {status_desc}</span>
             """, unsafe_allow_html=True)
+        
+        with st.expander("📄 Volledige werkordergegevens"):
+            job_document = load_job_document(klant_id, selected_job_id)
+            if job_document is None:
+                st.info("Geen gegevens gevonden in de lokale cache")
+            else:
+                st.json(job_document)
     
     # Completion form
     with st.container():
@@ -1109,46 +859,123 @@ def display_customer_jobs_modern(klant_id, jobs, mappings, jobs_data):
                 if not target_status:
                     st.error("❌ Geen doelstatus configuratie gevonden voor deze werkorder.")
                 else:
-                    with st.spinner("⏳ Werkorder wordt bijgewerkt..."):
-                        if update_job_status(domein, api_key, selected_job_id, target_status, feedback):
-                            st.success(f"✅ Werkorder {selected_job_id} succesvol bijgewerkt!")
-                            
-                            # Handle file uploads
-                            images = [image1, image2, image3, image4]
-                            documents = [doc1, doc2, doc3, doc4]
-                            
-                            if any(img is not None for img in images):
-                                with st.spinner("📤 Afbeeldingen worden geüpload..."):
-                                    # Placeholder for image upload function
-                                    st.info("📸 Afbeelding upload functionaliteit wordt toegevoegd...")
-                            
-                            if any(doc is not None for doc in documents):
-                                with st.spinner("📄 Documenten worden geüpload..."):
-                                    # Placeholder for document upload function
-                                    st.info("📄 Document upload functionaliteit wordt toegevoegd...")
-                            
-                            # Update local cache
-                            conn = sqlite3.connect('leveranciers_portal.db')
-                            c = conn.cursor()
-                            
-                            job_data = jobs_data[selected_job_id]
-                            job_data["ProgressStatus"] = target_status
-                            if feedback:
-                                job_data["FeedbackText"] = feedback
-                            
-                            c.execute("""
-                            UPDATE jobs_cache
-                            SET voortgang_status = ?, data = ?
-                            WHERE id = ? AND klant_id = ?
-                            """, (target_status, json.dumps(job_data), selected_job_id, klant_id))
-                            
-                            conn.commit()
-                            conn.close()
-                            
-                            time.sleep(2)
-                            st.rerun()
-                        else:
-                            st.error("❌ Bijwerken van werkorder mislukt. Probeer het opnieuw.")
+                    flash = []
+                    
+                    # Handle file uploads - parallel en gestreamd, identieke inhoud wordt overgeslagen
+                    images = [image1, image2, image3, image4]
+                    documents = [doc1, doc2, doc3, doc4]
+                    files = [("afbeelding", img) for img in images] + [("document", doc) for doc in documents]
+                    uploads, skipped = prepare_attachments(klant_id, selected_job_id, files)
+                    
+                    if uploads:
+                        st.markdown("📤 **Bijlagen worden geüpload...**")
+                        bars = [st.progress(0.0, text=upload.bestandsnaam) for upload in uploads]
+                        
+                        def show_upload_progress():
+                            for bar, upload in zip(bars, uploads):
+                                bar.progress(upload.progress, text=f"{upload.bestandsnaam} ({upload.progress:.0%})")
+                        
+                        upload_attachments(domein, api_key, klant_id, uploads, on_progress=show_upload_progress)
+                        
+                        failed = [upload for upload in uploads if upload.error]
+                        sent = [upload for upload in uploads if not upload.error]
+                        if sent:
+                            original_mb = sum(upload.original_size for upload in sent) / 1024 / 1024
+                            sent_mb = sum(upload.size for upload in sent) / 1024 / 1024
+                            flash.append(("success", f"📎 {len(sent)} bijlage(n) gekoppeld aan werkorder {selected_job_id} "
+                                                     f"({original_mb:.1f} MB → {sent_mb:.1f} MB verstuurd)."))
+                        for upload in failed:
+                            flash.append(("error", f"❌ {upload.bestandsnaam} kon niet worden gekoppeld: {upload.error}"))
+                    
+                    for bestandsnaam, reden in skipped:
+                        flash.append(("info", f"ℹ️ {bestandsnaam} overgeslagen ({reden})."))
+                    
+                    # Vastleggen in de outbox; de dispatcher verstuurt de PATCH naar Ultimo
+                    outbox_id, nieuw = queue_completion(klant_id, selected_job_id, selected_job["voortgang_status"],
+                                                        target_status, feedback, email)
+                    
+                    if nieuw:
+                        flash.insert(0, ("success", f"📨 Werkorder {selected_job_id} staat in de wachtrij en wordt naar Ultimo verstuurd."))
+                    else:
+                        flash.insert(0, ("info", f"ℹ️ Werkorder {selected_job_id} stond al in de wachtrij."))
+                    st.session_state["completion_flash"] = flash
+                    st.rerun()
+
+def display_bulk_completion(klant_id, email, jobs_by_id, mappings, status_mapping):
+    """Rond meerdere werkorders van de huidige pagina in één keer af"""
+    result_key = f"bulk_result_{klant_id}"
+    if result_key in st.session_state:
+        results = st.session_state.pop(result_key)
+        ok_count = sum(1 for row in results if row[2].startswith("✅"))
+        st.markdown(f"**📦 Resultaat: {ok_count} van {len(results)} werkorders afgerond**")
+        st.dataframe(pd.DataFrame(results, columns=["Werkorder", "Naar Status", "Resultaat"]),
+                     use_container_width=True, hide_index=True)
+    
+    with st.form(f"bulk_complete_form_{klant_id}"):
+        st.markdown('<div class="modern-card"><h3>📦 Werkorders Afronden</h3></div>', unsafe_allow_html=True)
+        
+        select_all = st.checkbox(f"Alle {len(jobs_by_id)} werkorders op deze pagina selecteren", key=f"bulk_all_{klant_id}")
+        selected_ids = st.multiselect(
+            "🎯 Selecteer werkorders:",
+            list(jobs_by_id.keys()),
+            format_func=lambda x: f"{x}: {jobs_by_id[x]['omschrijving']}",
+            key=f"bulk_select_{klant_id}"
+        )
+        feedback = st.text_area(
+            "💬 Feedback Tekst (voor alle geselecteerde werkorders)",
+            height=100,
+            help="Beschrijf het uitgevoerde werk (max 2000 tekens)",
+            key=f"bulk_feedback_{klant_id}"
+        )
+        submit_button = st.form_submit_button("🚀 Geselecteerde Werkorders Afronden", use_container_width=True)
+    
+    if not submit_button:
+        return
+    
+    job_ids = list(jobs_by_id.keys()) if select_all else selected_ids
+    if not job_ids:
+        st.warning("⚠️ Selecteer ten minste één werkorder.")
+        return
+    
+    # Doelstatus per job via de status_toewijzingen van deze klant
+    items, results = [], []
+    for job_id in job_ids:
+        van_status = jobs_by_id[job_id]["voortgang_status"]
+        target_status = mappings.get(van_status)
+        if target_status:
+            items.append((klant_id, job_id, van_status, target_status, feedback))
+        else:
+            results.append((job_id, "-", "❌ Geen doelstatus configuratie"))
+    
+    # Alles in één transactie in de outbox (en optimistisch in jobs_cache)
+    queued = queue_completions(items, email)
+    outbox_ids = [outbox_id for outbox_id, _ in queued]
+    
+    progress = st.progress(0.0, text=f"📤 0 van {len(outbox_ids)} werkorders verstuurd")
+    
+    def show_progress(klaar, totaal):
+        progress.progress(klaar / max(1, totaal), text=f"📤 {klaar} van {totaal} werkorders verstuurd")
+    
+    outcomes = dispatch_completions(outbox_ids, on_progress=show_progress)
+    
+    status_labels = {
+        "verzonden": "✅ Afgerond",
+        "wachtend": "⏳ In wachtrij, wordt opnieuw geprobeerd",
+        "bezig": "📤 Wordt verstuurd",
+        "mislukt": "❌ Mislukt"
+    }
+    for (_, job_id, _, target_status, _), (outbox_id, _) in zip(items, queued):
+        _, status, fout = outcomes.get(outbox_id, (job_id, "wachtend", None))
+        label = status_labels.get(status, status)
+        if fout and status != "verzonden":
+            label += f": {fout}"
+        results.append((job_id, f"{target_status}: {status_mapping.get(target_status, target_status)}", label))
+    
+    st.session_state[result_key] = results
+    # Afgeronde jobs verdwijnen uit de lijst; selectie niet meenemen naar de volgende run
+    st.session_state.pop(f"bulk_select_{klant_id}", None)
+    st.session_state.pop(f"bulk_all_{klant_id}", None)
+    st.rerun()
 
 # MODERN ADMIN PAGE - Fully functional
 def admin_page():
@@ -1191,6 +1018,14 @@ def manage_customers_modern():
                 domein = st.text_input("Domein", placeholder="025105.ultimo-demo.net")
             with col2:
                 api_key = st.text_input("API Sleutel", placeholder="Voer API key in")
+                page_size = st.number_input(
+                    "Paginagrootte (sync)", 
+                    min_value=MIN_PAGE_SIZE, 
+                    max_value=MAX_PAGE_SIZE, 
+                    value=DEFAULT_PAGE_SIZE, 
+                    step=50,
+                    help="Startgrootte van de jobpagina's; past zich automatisch aan de responstijd aan"
+                )
             
             st.markdown("<br>", unsafe_allow_html=True)
             
@@ -1212,12 +1047,10 @@ def manage_customers_modern():
         if submit_button and naam and domein and api_key:
             with st.spinner("💾 Klant wordt toegevoegd..."):
                 try:
-                    conn = sqlite3.connect('leveranciers_portal.db')
-                    c = conn.cursor()
-                    c.execute("INSERT INTO klanten (naam, domein, api_key) VALUES (?, ?, ?)",
-                              (naam, domein, api_key))
-                    conn.commit()
-                    conn.close()
+                    with db_connection() as conn:
+                        conn.execute("INSERT INTO klanten (naam, domein, api_key, page_size) VALUES (?, ?, ?, ?)",
+                                     (naam, domein, api_key, int(page_size)))
+                        bump_generation(conn)
                     st.success(f"🎉 Klant **{naam}** succesvol toegevoegd!")
                     time.sleep(1)
                     st.rerun()
@@ -1228,20 +1061,14 @@ def manage_customers_modern():
     display_customers_modern()
 
 def display_customers_modern():
-    conn = sqlite3.connect('leveranciers_portal.db')
-    
     try:
-        df = pd.read_sql_query("SELECT id, naam, domein FROM klanten", conn)
+        df = load_klanten_df()[["id", "naam", "domein"]]
         
         # Haal ook API keys op voor testing
-        c = conn.cursor()
-        c.execute("SELECT id, naam, domein, api_key FROM klanten")
-        klanten = c.fetchall()
+        klanten = load_klanten()
     except Exception as e:
         st.error(f"Database fout: {str(e)}")
         return
-    finally:
-        conn.close()
     
     if not df.empty:
         with st.container():
@@ -1292,13 +1119,19 @@ def display_customers_modern():
                             if st.button(f"⚠️ BEVESTIG: Verwijder {selected_customer[1]}", key="confirm_delete", type="secondary"):
                                 with st.spinner("🗑️ Klant wordt verwijderd..."):
                                     try:
-                                        conn = sqlite3.connect('leveranciers_portal.db')
-                                        c = conn.cursor()
-                                        c.execute("DELETE FROM status_toewijzingen WHERE klant_id = ?", (klant_id,))
-                                        c.execute("DELETE FROM jobs_cache WHERE klant_id = ?", (klant_id,))
-                                        c.execute("DELETE FROM klanten WHERE id = ?", (klant_id,))
-                                        conn.commit()
-                                        conn.close()
+                                        with db_connection() as conn:
+                                            c = conn.cursor()
+                                            c.execute("DELETE FROM status_toewijzingen WHERE klant_id = ?", (klant_id,))
+                                            c.execute("DELETE FROM jobs_cache WHERE klant_id = ?", (klant_id,))
+                                            c.execute("DELETE FROM sync_state WHERE klant_id = ?", (klant_id,))
+                                            c.execute("DELETE FROM job_contacts WHERE klant_id = ?", (klant_id,))
+                                            c.execute("DELETE FROM voortgang_statussen WHERE klant_id = ?", (klant_id,))
+                                            c.execute("DELETE FROM referenties WHERE klant_id = ?", (klant_id,))
+                                            c.execute("DELETE FROM job_bijlagen WHERE klant_id = ?", (klant_id,))
+                                            c.execute("DELETE FROM completion_outbox WHERE klant_id = ?", (klant_id,))
+                                            c.execute("DELETE FROM klanten WHERE id = ?", (klant_id,))
+                                            bump_generation(conn)
+                                        invalidate_status_catalog(klant_id)
                                         st.success(f"🗑️ Klant **{selected_customer[1]}** succesvol verwijderd!")
                                         time.sleep(1)
                                         st.rerun()
@@ -1318,9 +1151,7 @@ def manage_progress_status_mappings_modern():
     with st.container():
         st.markdown('<div class="modern-card"><h3>🔄 Status Toewijzingen Beheren</h3></div>', unsafe_allow_html=True)
         
-        conn = sqlite3.connect('leveranciers_portal.db')
-        klanten_df = pd.read_sql_query("SELECT id, naam, domein, api_key FROM klanten", conn)
-        conn.close()
+        klanten_df = load_klanten_df()
         
         if klanten_df.empty:
             st.markdown("""
@@ -1342,9 +1173,18 @@ def manage_progress_status_mappings_modern():
         domein = klant_row["domein"]
         api_key = klant_row["api_key"]
         
-        # Haal voortgangsstatussen op van API
+        # Voortgangsstatussen komen uit de lokale catalogus die de sync ververst
+        if st.button("🔄 Statussen Vernieuwen", key="refresh_status_catalog"):
+            with st.spinner("📊 Voortgangsstatussen worden opgehaald..."):
+                try:
+                    with db_connection() as conn:
+                        refresh_status_catalog(conn, klant_id, domein, api_key,
+                                               datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), max_age=0)
+                except Exception as e:
+                    st.error(f"❌ Fout bij het ophalen van voortgangsstatussen: {str(e)}")
+        
         with st.spinner("📊 Voortgangsstatussen worden opgehaald..."):
-            voortgang_statussen = get_progress_statuses(domein, api_key)
+            voortgang_statussen = get_status_catalog(klant_id, domein, api_key)
         
         if not voortgang_statussen:
             st.warning("⚠️ Kan voortgangsstatussen niet ophalen. Controleer de API-verbinding.")
@@ -1378,41 +1218,36 @@ def manage_progress_status_mappings_modern():
         
         if submit_button:
             with st.spinner("💾 Toewijzing wordt toegevoegd..."):
-                conn = sqlite3.connect('leveranciers_portal.db')
-                c = conn.cursor()
-                
-                # Controleer of toewijzing al bestaat
-                c.execute("""
-                SELECT COUNT(*) FROM status_toewijzingen 
-                WHERE klant_id = ? AND van_status = ?
-                """, (klant_id, van_status))
-                
-                count = c.fetchone()[0]
+                with db_connection() as conn:
+                    c = conn.cursor()
+                    
+                    # Controleer of toewijzing al bestaat
+                    c.execute("""
+                    SELECT COUNT(*) FROM status_toewijzingen 
+                    WHERE klant_id = ? AND van_status = ?
+                    """, (klant_id, van_status))
+                    
+                    count = c.fetchone()[0]
+                    
+                    if count == 0:
+                        c.execute("""
+                        INSERT INTO status_toewijzingen (klant_id, van_status, naar_status)
+                        VALUES (?, ?, ?)
+                        """, (klant_id, van_status, naar_status))
+                        bump_generation(conn)
                 
                 if count > 0:
                     st.error(f"❌ Er bestaat al een toewijzing voor **Van Status: {van_status}** voor deze klant.")
                 else:
-                    c.execute("""
-                    INSERT INTO status_toewijzingen (klant_id, van_status, naar_status)
-                    VALUES (?, ?, ?)
-                    """, (klant_id, van_status, naar_status))
-                    conn.commit()
                     st.success("🎉 Toewijzing succesvol toegevoegd!")
                     time.sleep(1)
                     st.rerun()
-                
-                conn.close()
     
     # Toon bestaande toewijzingen
     display_status_mappings_modern(klant_id, status_options)
 
 def display_status_mappings_modern(klant_id, status_options):
-    conn = sqlite3.connect('leveranciers_portal.db')
-    toewijzingen_df = pd.read_sql_query("""
-    SELECT id, van_status, naar_status FROM status_toewijzingen
-    WHERE klant_id = ?
-    """, conn, params=(klant_id,))
-    conn.close()
+    toewijzingen_df = load_status_mappings_df(klant_id)
     
     if not toewijzingen_df.empty:
         with st.container():
@@ -1448,11 +1283,9 @@ def display_status_mappings_modern(klant_id, status_options):
             
             if st.button("🗑️ Verwijder Geselecteerde Toewijzing", use_container_width=True, key="delete_mapping_btn"):
                 with st.spinner("🗑️ Toewijzing wordt verwijderd..."):
-                    conn = sqlite3.connect('leveranciers_portal.db')
-                    c = conn.cursor()
-                    c.execute("DELETE FROM status_toewijzingen WHERE id = ?", (toewijzing_id,))
-                    conn.commit()
-                    conn.close()
+                    with db_connection() as conn:
+                        conn.execute("DELETE FROM status_toewijzingen WHERE id = ?", (toewijzing_id,))
+                        bump_generation(conn)
                     st.success("🗑️ Toewijzing succesvol verwijderd!")
                     time.sleep(1)
                     st.rerun()
@@ -1471,11 +1304,7 @@ def manage_supplier_access_modern():
         st.markdown('<div class="modern-card"><h3>👥 Leveranciers Toegang Beheren</h3></div>', unsafe_allow_html=True)
         
         # Haal alle klanten op voor filtering
-        conn = sqlite3.connect('leveranciers_portal.db')
-        c = conn.cursor()
-        
-        c.execute("SELECT id, naam FROM klanten")
-        klanten = c.fetchall()
+        klanten = [(klant_id, naam) for klant_id, naam, _, _ in load_klanten()]
         
         if not klanten:
             st.markdown("""
@@ -1484,7 +1313,6 @@ def manage_supplier_access_modern():
                 <p>Voeg eerst klanten toe om leveranciers toegang te kunnen beheren.</p>
             </div>
             """, unsafe_allow_html=True)
-            conn.close()
             return
         
         klant_options = {klant_id: naam for klant_id, naam in klanten}
@@ -1497,80 +1325,37 @@ def manage_supplier_access_modern():
             key="supplier_access_filter"
         )
         
-        # Query om e-mails uit jobgegevens te halen
-        if selected_customer == 0:
-            query = """
-            SELECT jc.id, jc.omschrijving, k.naam as klant_naam, 
-                   json_extract(jc.data, '$.Vendor.ObjectContacts') as contacts,
-                   jc.data
-            FROM jobs_cache jc
-            JOIN klanten k ON jc.klant_id = k.id
-            """
-            c.execute(query)
-        else:
-            query = """
-            SELECT jc.id, jc.omschrijving, k.naam as klant_naam, 
-                   json_extract(jc.data, '$.Vendor.ObjectContacts') as contacts,
-                   jc.data
-            FROM jobs_cache jc
-            JOIN klanten k ON jc.klant_id = k.id
-            WHERE jc.klant_id = ?
-            """
-            c.execute(query, (selected_customer,))
+        zoekterm = st.text_input("🔎 Zoek op e-mail, naam of leverancier:", key="supplier_access_search").strip()
         
-        jobs = c.fetchall()
-        conn.close()
+        # Groeperen, zoeken en bladeren gebeurt in SQL; alleen de getoonde pagina wordt geladen
+        page_key = "supplier_access_page"
+        if st.session_state.get("supplier_access_prev") != (selected_customer, zoekterm):
+            st.session_state["supplier_access_prev"] = (selected_customer, zoekterm)
+            st.session_state[page_key] = 0
+        page = st.session_state.get(page_key, 0)
         
-        # Verwerk de jobs om e-mails te extraheren
-        emails = {}
-        for job in jobs:
-            job_id, omschrijving, klant_naam, contacts_json, data_json = job
-            
-            try:
-                data = json.loads(data_json)
-                
-                if 'Vendor' in data and data['Vendor'] is not None and 'ObjectContacts' in data['Vendor']:
-                    for contact in data['Vendor']['ObjectContacts']:
-                        if 'Employee' in contact and contact['Employee'] is not None:
-                            employee = contact['Employee']
-                            if 'EmailAddress' in employee and employee['EmailAddress']:
-                                email = employee['EmailAddress']
-                                name = employee.get('Description', '')
-                                vendor_id = data['Vendor'].get('Id', '')
-                                vendor_name = data['Vendor'].get('Description', '')
-                                
-                                if email not in emails:
-                                    emails[email] = {
-                                        'name': name,
-                                        'vendor_id': vendor_id,
-                                        'vendor_name': vendor_name,
-                                        'jobs': [],
-                                        'klant_naam': klant_naam
-                                    }
-                                
-                                job_info = {'id': job_id, 'omschrijving': omschrijving, 'klant_naam': klant_naam}
-                                if job_info not in emails[email]['jobs']:
-                                    emails[email]['jobs'].append(job_info)
-            except Exception as e:
-                print(f"Error processing job {job_id}: {str(e)}")
-                continue
+        rows, totaal = load_supplier_directory(selected_customer, zoekterm, SUPPLIER_PAGE_SIZE, page * SUPPLIER_PAGE_SIZE)
+        page_count = max(1, -(-totaal // SUPPLIER_PAGE_SIZE))
+        
+        if page >= page_count:
+            page = st.session_state[page_key] = page_count - 1
+            rows, totaal = load_supplier_directory(selected_customer, zoekterm, SUPPLIER_PAGE_SIZE, page * SUPPLIER_PAGE_SIZE)
         
         # Toon de e-mails
-        if emails:
-            st.success(f"✅ {len(emails)} leveranciers e-mails gevonden met toegang")
+        if rows:
+            st.success(f"✅ {totaal} leveranciers e-mails gevonden met toegang")
+            display_pager(page_key, page, page_count, f"{totaal} e-mails")
             
-            # Maak een dataframe voor weergave
-            rows = []
-            for email, info in emails.items():
-                job_count = len(info['jobs'])
-                rows.append({
+            df = pd.DataFrame([
+                {
                     '📧 E-mail': email,
-                    '👤 Naam': info['name'] or 'Niet opgegeven',
-                    '🏢 Leverancier': f"{info['vendor_id']}: {info['vendor_name']}" if info['vendor_id'] else 'Onbekend',
+                    '👤 Naam': name or 'Niet opgegeven',
+                    '🏢 Leverancier': leveranciers or 'Onbekend',
+                    '🏭 Klanten': klanten,
                     '📊 Aantal Jobs': job_count
-                })
-            
-            df = pd.DataFrame(rows)
+                }
+                for email, name, job_count, leveranciers, klanten in rows
+            ])
             st.dataframe(
                 df, 
                 use_container_width=True,
@@ -1579,45 +1364,45 @@ def manage_supplier_access_modern():
                     "📧 E-mail": st.column_config.TextColumn("E-mail", width="large"),
                     "👤 Naam": st.column_config.TextColumn("Naam", width="medium"),
                     "🏢 Leverancier": st.column_config.TextColumn("Leverancier", width="large"),
+                    "🏭 Klanten": st.column_config.TextColumn("Klanten", width="medium"),
                     "📊 Aantal Jobs": st.column_config.NumberColumn("Jobs", width="small"),
                 }
             )
             
             # Toon details voor een geselecteerde e-mail
-            if rows:
-                email_options = [row['📧 E-mail'] for row in rows]
-                selected_email = st.selectbox(
-                    "🔍 Bekijk Jobs voor E-mail:", 
-                    email_options,
-                    key="email_detail_select"
-                )
+            job_counts = {email: job_count for email, _, job_count, _, _ in rows}
+            selected_email = st.selectbox(
+                "🔍 Bekijk Jobs voor E-mail:", 
+                list(job_counts.keys()),
+                key="email_detail_select"
+            )
+            
+            if selected_email:
+                st.markdown(f"#### 📋 Jobs voor **{selected_email}**")
+                jobs = load_contact_jobs(selected_email, selected_customer, JOB_PAGE_SIZE)
                 
-                if selected_email in emails:
-                    st.markdown(f"#### 📋 Jobs voor **{selected_email}**")
-                    info = emails[selected_email]
+                if jobs:
+                    if job_counts[selected_email] > len(jobs):
+                        st.caption(f"Eerste {len(jobs)} van {job_counts[selected_email]} jobs")
                     
-                    if info['jobs']:
-                        job_rows = []
-                        for job in info['jobs']:
-                            job_rows.append({
-                                '🆔 Job ID': job['id'],
-                                '📝 Omschrijving': job['omschrijving'],
-                                '🏢 Klant': job['klant_naam']
-                            })
-                        
-                        job_df = pd.DataFrame(job_rows)
-                        st.dataframe(
-                            job_df, 
-                            use_container_width=True,
-                            hide_index=True,
-                            column_config={
-                                "🆔 Job ID": st.column_config.TextColumn("Job ID", width="medium"),
-                                "📝 Omschrijving": st.column_config.TextColumn("Omschrijving", width="large"),
-                                "🏢 Klant": st.column_config.TextColumn("Klant", width="medium"),
-                            }
-                        )
-                    else:
-                        st.info("📭 Geen jobs gevonden voor deze e-mail.")
+                    job_df = pd.DataFrame([
+                        {'🆔 Job ID': job_id, '📝 Omschrijving': omschrijving, '🏢 Klant': klant_naam}
+                        for job_id, omschrijving, klant_naam in jobs
+                    ])
+                    st.dataframe(
+                        job_df, 
+                        use_container_width=True,
+                        hide_index=True,
+                        column_config={
+                            "🆔 Job ID": st.column_config.TextColumn("Job ID", width="medium"),
+                            "📝 Omschrijving": st.column_config.TextColumn("Omschrijving", width="large"),
+                            "🏢 Klant": st.column_config.TextColumn("Klant", width="medium"),
+                        }
+                    )
+                else:
+                    st.info("📭 Geen jobs gevonden voor deze e-mail.")
+        elif zoekterm:
+            st.info("🔎 Geen leveranciers gevonden voor deze zoekopdracht.")
         else:
             st.markdown("""
             <div style="text-align: center; padding: 2rem;">
@@ -1705,17 +1490,90 @@ def manage_sync_settings_modern():
             if submit_button:
                 with st.spinner("⚙️ Interval wordt bijgewerkt..."):
                     try:
-                        conn = sqlite3.connect('leveranciers_portal.db')
-                        c = conn.cursor()
-                        c.execute("UPDATE sync_control SET sync_interval = ? WHERE id = 1", (selected_interval,))
-                        conn.commit()
-                        conn.close()
+                        with db_connection() as conn:
+                            conn.execute("UPDATE sync_control SET sync_interval = ? WHERE id = 1", (selected_interval,))
+                        get_sync_wakeup().set()
                         st.success(f"✅ Interval bijgewerkt naar **{interval_options[selected_interval]}**")
                         time.sleep(1)
                         st.rerun()
                     except Exception as e:
                         st.error(f"❌ Fout bij bijwerken interval: {str(e)}")
         
+        # Interval per klant
+        st.markdown("#### 🏢 Interval per Klant")
+        
+        with db_connection() as conn:
+            klanten = conn.execute("SELECT id, naam, sync_interval FROM klanten").fetchall()
+        
+        if klanten:
+            klant_intervals = {klant_id: (naam, klant_interval) for klant_id, naam, klant_interval in klanten}
+            klant_interval_options = {0: "Standaard (globaal interval)"}
+            klant_interval_options.update(interval_options)
+            
+            with st.form("customer_sync_interval_form"):
+                klant_id = st.selectbox(
+                    "Klant:", 
+                    list(klant_intervals.keys()),
+                    format_func=lambda x: f"{klant_intervals[x][0]} ({interval_options.get(klant_intervals[x][1], 'standaard') if klant_intervals[x][1] else 'standaard'})",
+                    key="customer_sync_interval_klant"
+                )
+                klant_interval = st.selectbox(
+                    "🕐 Interval voor deze klant:", 
+                    list(klant_interval_options.keys()),
+                    format_func=lambda x: klant_interval_options[x],
+                    key="customer_sync_interval_select"
+                )
+                customer_submit = st.form_submit_button("💾 Klantinterval Bijwerken", use_container_width=True)
+            
+            if customer_submit:
+                try:
+                    with db_connection() as conn:
+                        conn.execute("UPDATE klanten SET sync_interval = ? WHERE id = ?", (klant_interval or None, klant_id))
+                        bump_generation(conn)
+                    get_sync_wakeup().set()
+                    st.success(f"✅ Interval voor **{klant_intervals[klant_id][0]}** bijgewerkt naar **{klant_interval_options[klant_interval]}**")
+                    time.sleep(1)
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"❌ Fout bij bijwerken interval: {str(e)}")
+        
+        # Paginagrootte per klant
+        st.markdown("#### 📄 Paginagrootte per Klant")
+        
+        with db_connection() as conn:
+            klant_page_sizes = {klant_id: (naam, page_size) for klant_id, naam, page_size
+                                in conn.execute("SELECT id, naam, page_size FROM klanten").fetchall()}
+        
+        if klant_page_sizes:
+            with st.form("customer_page_size_form"):
+                page_size_klant_id = st.selectbox(
+                    "Klant:", 
+                    list(klant_page_sizes.keys()),
+                    format_func=lambda x: f"{klant_page_sizes[x][0]} ({klant_page_sizes[x][1] or DEFAULT_PAGE_SIZE} jobs per pagina)",
+                    key="customer_page_size_klant"
+                )
+                klant_page_size = st.number_input(
+                    "Paginagrootte (sync)", 
+                    min_value=MIN_PAGE_SIZE, 
+                    max_value=MAX_PAGE_SIZE, 
+                    value=DEFAULT_PAGE_SIZE, 
+                    step=50,
+                    help="Startgrootte van de jobpagina's; past zich automatisch aan de responstijd aan",
+                    key="customer_page_size_input"
+                )
+                page_size_submit = st.form_submit_button("💾 Paginagrootte Bijwerken", use_container_width=True)
+            
+            if page_size_submit:
+                try:
+                    with db_connection() as conn:
+                        conn.execute("UPDATE klanten SET page_size = ? WHERE id = ?", (int(klant_page_size), page_size_klant_id))
+                        bump_generation(conn)
+                    st.success(f"✅ Paginagrootte voor **{klant_page_sizes[page_size_klant_id][0]}** bijgewerkt naar **{int(klant_page_size)}**")
+                    time.sleep(1)
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"❌ Fout bij bijwerken paginagrootte: {str(e)}")
+        
         # API Usage Information
         st.markdown("#### 📖 Over Synchronisatie")
         st.markdown("""
@@ -1728,7 +1586,7 @@ def manage_sync_settings_modern():
         ">
             <h5>🔄 Hoe werkt synchronisatie?</h5>
             <ul>
-                <li><strong>Automatisch:</strong> Volgens het ingestelde interval</li>
+                <li><strong>Automatisch:</strong> Volgens het ingestelde interval (per klant instelbaar)</li>
                 <li><strong>Handmatig:</strong> Via de sync knop</li>
                 <li><strong>Bij opstarten:</strong> Eerste keer wanneer app start</li>
             </ul>
@@ -1751,14 +1609,16 @@ def manage_sync_settings_modern():
 
 # MAIN APPLICATION
 def main():
-    init_db()
+    ensure_schema()
     
     if "logged_in" not in st.session_state:
         st.session_state["logged_in"] = False
     
-    if "sync_started" not in st.session_state:
+    # Met een aparte sync daemon (leveranciers_sync.py) kan de sync in de app uit
+    if os.getenv("PORTAL_SYNC_IN_APP", "1") != "0":
         start_sync_thread()
-        st.session_state["sync_started"] = True
+    # Claims in de outbox zijn atomair, dus de dispatcher mag naast de daemon draaien
+    start_outbox_dispatcher()
     
     if "current_page" not in st.session_state:
         st.session_state["current_page"] = "supplier"
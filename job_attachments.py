@@ -0,0 +1,265 @@
+import base64
+import datetime
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+from dotenv import load_dotenv
+
+from ultimo_client import get_client
+from portal_db import db_connection
+
+# Pillow is optioneel: zonder Pillow worden afbeeldingen ongewijzigd verstuurd
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Load environment variables
+load_dotenv()
+
+# ATTACHMENT PIPELINE - Parallel, streaming uploads with content-hash deduplication
+ATTACHMENT_MAX_WORKERS = int(os.getenv("ATTACHMENT_MAX_WORKERS", "4"))
+ATTACHMENT_RETRIES = int(os.getenv("ATTACHMENT_RETRIES", "1"))
+ATTACH_IMAGE_ACTION = os.getenv("ULTIMO_ATTACH_IMAGE_ACTION", "REST_AttachImageToJob")
+ATTACH_DOCUMENT_ACTION = os.getenv("ULTIMO_ATTACH_DOCUMENT_ACTION", "REST_AttachDocumentToJob")
+APPLICATION_ELEMENT_ID = os.getenv("ULTIMO_APPLICATION_ELEMENT_ID", "D1FB01D577C248DFB95A2ADA578578DF")
+
+IMAGE_OPTIMIZE = os.getenv("IMAGE_OPTIMIZE", "1") != "0"
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "2048"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "80"))
+
+# Ruwe blokgrootte; een veelvoud van 3 zodat base64 blokken zonder padding aan elkaar passen
+CHUNK_SIZE = 3 * 64 * 1024
+
+# soort -> (Ultimo action, naam van het base64 veld)
+ATTACHMENT_TYPES = {
+    "afbeelding": (ATTACH_IMAGE_ACTION, "ImageFileBase64"),
+    "document": (ATTACH_DOCUMENT_ACTION, "DocumentFileBase64"),
+}
+
+class Base64JsonBody:
+    """JSON request body waarvan het base64 veld pas tijdens het versturen blok voor blok gecodeerd wordt.
+    
+    Heeft een lengte (voor Content-Length) en telt de verstuurde bytes voor voortgangsweergave.
+    """
+    
+    def __init__(self, fields, base64_field, fileobj, size):
+        head = json.dumps(fields)[:-1] + ", " + json.dumps(base64_field) + ': "'
+        self._buffer = head.encode("utf-8")
+        self._suffix = b'"}'
+        self._length = len(self._buffer) + 4 * ((size + 2) // 3) + len(self._suffix)
+        self._file = fileobj
+        self._rest = b""
+        self._done = False
+        self.sent = 0
+    
+    def __len__(self):
+        return self._length
+    
+    def _fill(self, size):
+        while not self._done and (size < 0 or len(self._buffer) < size):
+            chunk = self._file.read(CHUNK_SIZE)
+            if chunk:
+                raw = self._rest + chunk
+                cut = len(raw) - len(raw) % 3
+                self._buffer += base64.b64encode(raw[:cut])
+                self._rest = raw[cut:]
+            else:
+                self._buffer += base64.b64encode(self._rest) + self._suffix
+                self._rest = b""
+                self._done = True
+    
+    def read(self, size=-1):
+        self._fill(size)
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        self.sent += len(data)
+        return data
+
+def file_sha256(fileobj):
+    """SHA-256 van de inhoud, in blokken gelezen; de positie wordt teruggezet naar het begin"""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+class AttachmentUpload:
+    """Eén te versturen bijlage met hash, grootte en voortgang"""
+    
+    def __init__(self, job_id, soort, bestandsnaam, fileobj):
+        self.job_id = job_id
+        self.soort = soort
+        self.bestandsnaam = bestandsnaam
+        self.fileobj = fileobj
+        self.fileobj.seek(0, os.SEEK_END)
+        self.size = self.fileobj.tell()
+        self.original_size = self.size
+        # De hash van het origineel, zodat dezelfde foto ook na optimalisatie herkend wordt
+        self.sha256 = file_sha256(fileobj)
+        self.body = None
+        self.error = None
+    
+    @property
+    def progress(self):
+        if self.body is None:
+            return 0.0
+        return min(1.0, self.body.sent / max(1, len(self.body)))
+    
+    def optimize(self):
+        """Verklein en hercodeer een afbeelding (in de worker thread).
+        
+        Het origineel blijft staan bij een fout of als het resultaat niet kleiner is.
+        """
+        if self.soort != "afbeelding" or not IMAGE_OPTIMIZE or Image is None:
+            return
+        try:
+            optimized, bestandsnaam = optimize_image(self.fileobj, self.bestandsnaam)
+        except Exception as e:
+            print(f"Afbeelding {self.bestandsnaam} niet geoptimaliseerd: {str(e)}")
+            self.fileobj.seek(0)
+            return
+        if len(optimized.getbuffer()) >= self.size:
+            # Al klein of goed gecomprimeerd: hercoderen levert niets op
+            print(f"Afbeelding {self.bestandsnaam} niet kleiner na optimalisatie; origineel wordt verstuurd")
+            self.fileobj.seek(0)
+            return
+        self.fileobj = optimized
+        self.bestandsnaam = bestandsnaam
+        self.size = len(optimized.getbuffer())
+    
+    def build_body(self):
+        """Nieuwe streaming body vanaf het begin van het bestand (ook bij een nieuwe poging)"""
+        _, base64_field = ATTACHMENT_TYPES[self.soort]
+        extension = os.path.splitext(self.bestandsnaam)[1].lower().lstrip(".")
+        self.fileobj.seek(0)
+        self.body = Base64JsonBody(
+            {"JobId": self.job_id, f"{base64_field}Extension": extension},
+            base64_field, self.fileobj, self.size
+        )
+        return self.body
+
+def optimize_image(fileobj, bestandsnaam):
+    """Draai volgens EXIF, verklein tot IMAGE_MAX_EDGE en sla opnieuw op zonder metadata.
+    
+    JPEG wordt met IMAGE_JPEG_QUALITY gecodeerd; PNG blijft (verliesvrij) PNG.
+    Geeft (BytesIO, bestandsnaam) terug.
+    """
+    fileobj.seek(0)
+    with Image.open(fileobj) as img:
+        is_png = img.format == "PNG"
+        # JPEG decoder direct op een kleinere schaal laten decoderen
+        img.draft("RGB", (IMAGE_MAX_EDGE, IMAGE_MAX_EDGE))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE), Image.LANCZOS)
+        
+        output = io.BytesIO()
+        base_name = os.path.splitext(bestandsnaam)[0]
+        # Zonder exif/pnginfo argumenten neemt Pillow geen metadata mee
+        if is_png:
+            img.save(output, format="PNG", optimize=True)
+            bestandsnaam = f"{base_name}.png"
+        else:
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            img.save(output, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True, progressive=True)
+            bestandsnaam = f"{base_name}.jpg"
+    
+    output.seek(0)
+    return output, bestandsnaam
+
+def prepare_attachments(klant_id, job_id, files):
+    """Maak uploads van (soort, bestand) paren en sla dubbele of eerder geüploade inhoud over.
+    
+    Geeft (uploads, overgeslagen) terug; `overgeslagen` bevat (bestandsnaam, reden).
+    """
+    candidates = [AttachmentUpload(job_id, soort, f.name, f) for soort, f in files if f is not None]
+    if not candidates:
+        return [], []
+    
+    with db_connection() as conn:
+        placeholders = ", ".join("?" for _ in candidates)
+        known = {row[0] for row in conn.execute(
+            f"SELECT sha256 FROM job_bijlagen WHERE klant_id = ? AND job_id = ? AND sha256 IN ({placeholders})",
+            [klant_id, job_id] + [upload.sha256 for upload in candidates]
+        )}
+    
+    uploads, skipped, seen = [], [], set()
+    for upload in candidates:
+        if upload.sha256 in known:
+            skipped.append((upload.bestandsnaam, "al eerder geüpload"))
+        elif upload.sha256 in seen:
+            skipped.append((upload.bestandsnaam, "dubbel in deze inzending"))
+        else:
+            seen.add(upload.sha256)
+            uploads.append(upload)
+    return uploads, skipped
+
+def send_attachment(domein, api_key, upload):
+    """Optimaliseer en POST één bijlage; netwerkfouten en 5xx worden ATTACHMENT_RETRIES keer herhaald"""
+    upload.optimize()
+    action, _ = ATTACHMENT_TYPES[upload.soort]
+    headers = {
+        "ApplicationElementId": APPLICATION_ELEMENT_ID,
+        "Content-Type": "application/json"
+    }
+    error = None
+    
+    for _ in range(ATTACHMENT_RETRIES + 1):
+        try:
+            response = get_client(domein, api_key).post(f"action/{action}", data=upload.build_body(), headers=headers)
+        except requests.RequestException as e:
+            error = f"Verbindingsfout: {str(e)}"
+            continue
+        
+        if response.status_code in (200, 204):
+            return
+        error = f"{response.status_code} - {response.text[:200]}"
+        if response.status_code < 500:
+            break
+    
+    raise RuntimeError(error)
+
+def record_attachment(conn, klant_id, upload):
+    conn.execute("""
+    INSERT OR IGNORE INTO job_bijlagen (klant_id, job_id, sha256, soort, bestandsnaam, grootte, geupload_op)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (klant_id, upload.job_id, upload.sha256, upload.soort, upload.bestandsnaam, upload.size,
+          datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+def upload_attachments(domein, api_key, klant_id, uploads, on_progress=None, poll_seconds=0.25):
+    """Verstuur uploads parallel (begrensd op ATTACHMENT_MAX_WORKERS).
+    
+    `on_progress` wordt vanuit de aanroepende thread periodiek aangeroepen, zodat de UI
+    voortgang kan tonen zonder Streamlit vanuit worker threads aan te spreken.
+    Geslaagde uploads worden vastgelegd in job_bijlagen; fouten staan in `upload.error`.
+    """
+    if not uploads:
+        return uploads
+    
+    with ThreadPoolExecutor(max_workers=ATTACHMENT_MAX_WORKERS, thread_name_prefix="bijlage") as executor:
+        futures = {executor.submit(send_attachment, domein, api_key, upload): upload for upload in uploads}
+        pending = set(futures)
+        
+        while pending:
+            done, pending = wait(pending, timeout=poll_seconds, return_when=FIRST_COMPLETED)
+            for future in done:
+                upload = futures[future]
+                try:
+                    future.result()
+                    with db_connection() as conn:
+                        record_attachment(conn, klant_id, upload)
+                except Exception as e:
+                    upload.error = str(e)
+                    print(f"Fout bij het koppelen van {upload.bestandsnaam} aan job {upload.job_id}: {upload.error}")
+            if on_progress:
+                on_progress()
+    
+    return uploads
@@ -0,0 +1,393 @@
+import os
+import time
+import datetime
+import socket
+import uuid
+from threading import Thread, Lock, BoundedSemaphore, Event
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from dotenv import load_dotenv
+
+from ultimo_client import get_client
+from portal_db import db_connection, close_connection, bump_generation
+
+# Load environment variables
+load_dotenv()
+
+# COMPLETION OUTBOX - Afrondingen worden lokaal vastgelegd en op de achtergrond verstuurd
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_RETRY_BASE = int(os.getenv("OUTBOX_RETRY_BASE", "15"))
+OUTBOX_RETRY_MAX = int(os.getenv("OUTBOX_RETRY_MAX", "3600"))
+OUTBOX_CLAIM_SECONDS = int(os.getenv("OUTBOX_CLAIM_SECONDS", "120"))
+OUTBOX_POLL_SECONDS = int(os.getenv("OUTBOX_POLL_SECONDS", "60"))
+OUTBOX_MAX_WORKERS = int(os.getenv("OUTBOX_MAX_WORKERS", "4"))
+OUTBOX_MAX_PER_DOMAIN = int(os.getenv("OUTBOX_MAX_PER_DOMAIN", "2"))
+MAX_FEEDBACK_LENGTH = 2000
+
+# Statussen waarbij opnieuw proberen zinvol is; andere 4xx zijn definitief
+RETRYABLE_STATUS_CODES = {408, 409, 423, 425, 429}
+
+_outbox_wakeup = Event()
+_outbox_stop = Event()
+_outbox_thread = None
+_outbox_thread_lock = Lock()
+_domain_slots = {}
+_domain_slots_lock = Lock()
+
+def _now():
+    return datetime.datetime.now()
+
+def _format_time(value):
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+def get_domain_slot(domein):
+    """Semaphore die het aantal gelijktijdige PATCHes per Ultimo domein begrenst"""
+    with _domain_slots_lock:
+        if domein not in _domain_slots:
+            _domain_slots[domein] = BoundedSemaphore(OUTBOX_MAX_PER_DOMAIN)
+        return _domain_slots[domein]
+
+def get_outbox_wakeup():
+    """Procesbreed event waarmee een nieuwe afronding de dispatcher direct wekt"""
+    return _outbox_wakeup
+
+def completion_key(klant_id, job_id, van_status, naar_status):
+    """Idempotentiesleutel: dezelfde overgang van dezelfde job staat maar één keer open"""
+    return f"{klant_id}:{job_id}:{van_status}:{naar_status}"
+
+def apply_job_status(conn, klant_id, job_id, voortgang_status, feedback=None, only_if_status=None):
+    """Zet de status (en feedback) van een job in jobs_cache; geeft True als er een rij wijzigde.
+    
+    De inhoud_hash wordt gewist zodat de eerstvolgende sync de job altijd opnieuw wegschrijft.
+    """
+    if feedback:
+        query = """
+        UPDATE jobs_cache
+        SET voortgang_status = ?, data = json_set(data, '$.ProgressStatus', ?, '$.FeedbackText', ?), inhoud_hash = NULL
+        WHERE id = ? AND klant_id = ?
+        """
+        params = [voortgang_status, voortgang_status, feedback, job_id, klant_id]
+    else:
+        query = """
+        UPDATE jobs_cache
+        SET voortgang_status = ?, data = json_set(data, '$.ProgressStatus', ?), inhoud_hash = NULL
+        WHERE id = ? AND klant_id = ?
+        """
+        params = [voortgang_status, voortgang_status, job_id, klant_id]
+    if only_if_status is not None:
+        query += " AND voortgang_status = ?"
+        params.append(only_if_status)
+    
+    changed = conn.execute(query, params).rowcount > 0
+    if changed:
+        bump_generation(conn)
+    return changed
+
+def revert_job_status(conn, entry):
+    """Draai de optimistische update van een mislukte afronding terug: status én FeedbackText.
+    
+    Alleen als de job nog op de doelstatus staat; een tussentijdse sync heeft dan al voorrang.
+    """
+    if entry["feedback"]:
+        if entry["vorige_feedback"] is None:
+            data = "json_remove(json_set(data, '$.ProgressStatus', ?), '$.FeedbackText')"
+            data_params = [entry["van_status"]]
+        else:
+            data = "json_set(data, '$.ProgressStatus', ?, '$.FeedbackText', ?)"
+            data_params = [entry["van_status"], entry["vorige_feedback"]]
+    else:
+        data = "json_set(data, '$.ProgressStatus', ?)"
+        data_params = [entry["van_status"]]
+    
+    changed = conn.execute(f"""
+    UPDATE jobs_cache
+    SET voortgang_status = ?, data = {data}, inhoud_hash = NULL
+    WHERE id = ? AND klant_id = ? AND voortgang_status = ?
+    """, [entry["van_status"]] + data_params + [entry["job_id"], entry["klant_id"], entry["naar_status"]]).rowcount > 0
+    if changed:
+        bump_generation(conn)
+    return changed
+
+def enqueue_completion(conn, klant_id, job_id, van_status, naar_status, feedback=None, email=None):
+    """Leg een afronding vast en werk jobs_cache optimistisch bij, in de transactie van de aanroeper.
+    
+    Geeft (outbox_id, nieuw) terug; bij een dubbele inzending is `nieuw` False.
+    """
+    if feedback:
+        feedback = feedback[:MAX_FEEDBACK_LENGTH]
+    feedback = feedback if feedback and feedback.strip() else None
+    
+    key = completion_key(klant_id, job_id, van_status, naar_status)
+    now_str = _format_time(_now())
+    c = conn.cursor()
+    c.execute("""
+    INSERT OR IGNORE INTO completion_outbox
+        (idempotentie_sleutel, klant_id, job_id, van_status, naar_status, feedback, email,
+         status, volgende_poging, aangemaakt_op)
+    VALUES (?, ?, ?, ?, ?, ?, ?, 'wachtend', ?, ?)
+    """, (key, klant_id, job_id, van_status, naar_status, feedback, email, now_str, now_str))
+    
+    if c.rowcount == 0:
+        c.execute("""
+        SELECT id FROM completion_outbox
+        WHERE idempotentie_sleutel = ? AND status IN ('wachtend', 'bezig')
+        """, (key,))
+        return c.fetchone()[0], False
+    
+    outbox_id = c.lastrowid
+    if feedback:
+        # De huidige FeedbackText bewaren, zodat een mislukte afronding die kan terugzetten
+        c.execute("""
+        UPDATE completion_outbox
+        SET vorige_feedback = (SELECT json_extract(data, '$.FeedbackText') FROM jobs_cache WHERE id = ? AND klant_id = ?)
+        WHERE id = ?
+        """, (job_id, klant_id, outbox_id))
+    apply_job_status(conn, klant_id, job_id, naar_status, feedback)
+    return outbox_id, True
+
+def queue_completion(klant_id, job_id, van_status, naar_status, feedback=None, email=None):
+    """Zet een afronding in de outbox en wek de dispatcher zodra de transactie gecommit is"""
+    with db_connection() as conn:
+        result = enqueue_completion(conn, klant_id, job_id, van_status, naar_status, feedback, email)
+    _outbox_wakeup.set()
+    return result
+
+def queue_completions(items, email=None):
+    """Zet meerdere afrondingen (klant_id, job_id, van_status, naar_status, feedback) in één transactie in de outbox.
+    
+    De dispatcher wordt niet gewekt; de aanroeper verstuurt ze zelf met dispatch_completions.
+    """
+    with db_connection() as conn:
+        return [enqueue_completion(conn, *item, email=email) for item in items]
+
+def claim_next_completion(conn, owner, outbox_id=None):
+    """Claim atomair de eerstvolgende afronding die aan de beurt is (of waarvan de claim verlopen is).
+    
+    Met `outbox_id` wordt alleen die afronding geclaimd, als die aan de beurt is.
+    """
+    now = _now()
+    now_str = _format_time(now)
+    claim = f"{owner}:{uuid.uuid4().hex[:8]}"
+    due_condition = """
+    ((status = 'wachtend' AND volgende_poging <= ?) OR (status = 'bezig' AND geclaimd_tot < ?))
+    """
+    due_params = [now_str, now_str]
+    if outbox_id is not None:
+        due_condition += " AND id = ?"
+        due_params.append(outbox_id)
+    
+    c = conn.cursor()
+    c.execute(f"""
+    UPDATE completion_outbox
+    SET status = 'bezig', geclaimd_door = ?, geclaimd_tot = ?, pogingen = pogingen + 1
+    WHERE id = (SELECT id FROM completion_outbox WHERE {due_condition} ORDER BY id LIMIT 1)
+      AND {due_condition}
+    """, [claim, _format_time(now + datetime.timedelta(seconds=OUTBOX_CLAIM_SECONDS))] + due_params + due_params)
+    conn.commit()
+    
+    if c.rowcount == 0:
+        return None
+    
+    c.execute("""
+    SELECT o.id, o.klant_id, o.job_id, o.van_status, o.naar_status, o.feedback, o.vorige_feedback,
+           o.pogingen, k.domein, k.api_key
+    FROM completion_outbox o
+    LEFT JOIN klanten k ON k.id = o.klant_id
+    WHERE o.geclaimd_door = ? AND o.status = 'bezig'
+    """, (claim,))
+    row = c.fetchone()
+    if row is None:
+        return None
+    keys = ("id", "klant_id", "job_id", "van_status", "naar_status", "feedback", "vorige_feedback",
+            "pogingen", "domein", "api_key", "claim")
+    return dict(zip(keys, row + (claim,)))
+
+def send_completion(entry):
+    """PATCH de job in Ultimo; geeft (geslaagd, definitief, foutmelding) terug"""
+    if not entry["domein"]:
+        return False, True, "Klant bestaat niet meer"
+    
+    data = {
+        "ProgressStatus": entry["naar_status"],
+        "RecordStatus": "016"  # Zet RecordStatus naar 016
+    }
+    if entry["feedback"]:
+        data["FeedbackText"] = entry["feedback"]
+    
+    try:
+        response = get_client(entry["domein"], entry["api_key"]).patch(f"object/Job('{entry['job_id']}')", json=data)
+    except Exception as e:
+        return False, False, f"Exception bij het bijwerken van job: {str(e)}"
+    
+    if response.status_code in (200, 204):
+        return True, False, None
+    
+    error_message = f"Fout bij het bijwerken van job: {response.status_code} - {response.text[:200]}"
+    permanent = 400 <= response.status_code < 500 and response.status_code not in RETRYABLE_STATUS_CODES
+    return False, permanent, error_message
+
+def retry_delay(pogingen):
+    """Exponentiële backoff tussen pogingen, begrensd op OUTBOX_RETRY_MAX"""
+    return min(OUTBOX_RETRY_BASE * 2 ** max(0, pogingen - 1), OUTBOX_RETRY_MAX)
+
+def finish_completion(conn, entry, success, permanent, error):
+    """Leg de uitkomst van een poging vast en breng jobs_cache in lijn met Ultimo"""
+    now = _now()
+    c = conn.cursor()
+    
+    if success:
+        c.execute("""
+        UPDATE completion_outbox
+        SET status = 'verzonden', verzonden_op = ?, laatste_fout = NULL, geclaimd_tot = NULL
+        WHERE id = ? AND geclaimd_door = ?
+        """, (_format_time(now), entry["id"], entry["claim"]))
+        # Een tussentijdse sync kan de oude status teruggezet hebben
+        apply_job_status(conn, entry["klant_id"], entry["job_id"], entry["naar_status"], entry["feedback"],
+                         only_if_status=entry["van_status"])
+        status = "verzonden"
+    elif permanent or entry["pogingen"] >= OUTBOX_MAX_ATTEMPTS:
+        c.execute("""
+        UPDATE completion_outbox
+        SET status = 'mislukt', laatste_fout = ?, geclaimd_tot = NULL
+        WHERE id = ? AND geclaimd_door = ?
+        """, (error, entry["id"], entry["claim"]))
+        # De optimistische update terugdraaien zodat de job weer afgerond kan worden
+        revert_job_status(conn, entry)
+        status = "mislukt"
+    else:
+        next_attempt = now + datetime.timedelta(seconds=retry_delay(entry["pogingen"]))
+        c.execute("""
+        UPDATE completion_outbox
+        SET status = 'wachtend', laatste_fout = ?, volgende_poging = ?, geclaimd_tot = NULL
+        WHERE id = ? AND geclaimd_door = ?
+        """, (error, _format_time(next_attempt), entry["id"], entry["claim"]))
+        status = "wachtend"
+    
+    conn.commit()
+    return status
+
+def dispatch_completion(entry):
+    """Verstuur één geclaimde afronding (begrensd per domein) en verwerk de uitkomst"""
+    with get_domain_slot(entry["domein"]):
+        success, permanent, error = send_completion(entry)
+    if error:
+        print(f"Outbox {entry['id']} (job {entry['job_id']}): {error}")
+    with db_connection() as conn:
+        return finish_completion(conn, entry, success, permanent, error)
+
+def next_outbox_wait(conn):
+    """Seconden tot de eerstvolgende afronding aan de beurt is, begrensd op OUTBOX_POLL_SECONDS"""
+    row = conn.execute("""
+    SELECT MIN(CASE WHEN status = 'wachtend' THEN volgende_poging ELSE geclaimd_tot END)
+    FROM completion_outbox WHERE status IN ('wachtend', 'bezig')
+    """).fetchone()
+    if not row or not row[0]:
+        return OUTBOX_POLL_SECONDS
+    try:
+        due = datetime.datetime.fromisoformat(row[0])
+    except ValueError:
+        return OUTBOX_POLL_SECONDS
+    return min(OUTBOX_POLL_SECONDS, max(1, (due - _now()).total_seconds()))
+
+def dispatch_completion_worker(entry):
+    """dispatch_completion in een kortlevende pool thread; sluit daarna de verbinding van die thread"""
+    try:
+        return dispatch_completion(entry)
+    finally:
+        close_connection()
+
+def run_outbox(wakeup=None, stop=None):
+    """Langlopende dispatcher; claims zijn atomair, dus meerdere processen kunnen naast elkaar draaien"""
+    wakeup = wakeup or Event()
+    stop = stop or Event()
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    
+    with ThreadPoolExecutor(max_workers=OUTBOX_MAX_WORKERS, thread_name_prefix="outbox") as executor:
+        while not stop.is_set():
+            wait_seconds = OUTBOX_POLL_SECONDS
+            try:
+                # Telkens maximaal OUTBOX_MAX_WORKERS afrondingen tegelijk versturen
+                while not stop.is_set():
+                    entries = []
+                    with db_connection() as conn:
+                        while len(entries) < OUTBOX_MAX_WORKERS:
+                            entry = claim_next_completion(conn, owner)
+                            if entry is None:
+                                break
+                            entries.append(entry)
+                    if not entries:
+                        break
+                    list(executor.map(dispatch_completion, entries))
+                
+                with db_connection() as conn:
+                    wait_seconds = next_outbox_wait(conn)
+            except Exception as e:
+                print(f"Outbox dispatcher fout: {str(e)}")
+                time.sleep(1)
+            
+            wakeup.wait(wait_seconds)
+            wakeup.clear()
+    
+    # De workers van deze langlevende pool hergebruiken hun verbinding; bij het stoppen
+    # ook de verbinding van de dispatcher thread zelf sluiten
+    close_connection()
+
+def dispatch_completions(outbox_ids, on_progress=None, poll_seconds=0.25):
+    """Verstuur de gegeven afrondingen direct en parallel, en geef per afronding de uitkomst terug.
+    
+    `on_progress(klaar, totaal)` wordt vanuit de aanroepende thread aangeroepen. Afrondingen die
+    al door een andere dispatcher geclaimd zijn, worden met hun huidige status teruggegeven.
+    Resultaat: {outbox_id: (job_id, status, laatste_fout)}.
+    """
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    with db_connection() as conn:
+        entries = [entry for entry in (claim_next_completion(conn, owner, outbox_id) for outbox_id in outbox_ids) if entry]
+    
+    if entries:
+        with ThreadPoolExecutor(max_workers=OUTBOX_MAX_WORKERS, thread_name_prefix="outbox-batch") as executor:
+            pending = {executor.submit(dispatch_completion_worker, entry) for entry in entries}
+            while pending:
+                done, pending = wait(pending, timeout=poll_seconds, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(f"Outbox fout: {str(e)}")
+                if on_progress:
+                    on_progress(len(entries) - len(pending), len(entries))
+    
+    if not outbox_ids:
+        return {}
+    with db_connection() as conn:
+        placeholders = ", ".join("?" for _ in outbox_ids)
+        rows = conn.execute(f"""
+        SELECT id, job_id, status, laatste_fout FROM completion_outbox WHERE id IN ({placeholders})
+        """, list(outbox_ids)).fetchall()
+    return {row[0]: row[1:] for row in rows}
+
+def stop_outbox_dispatcher():
+    _outbox_stop.set()
+    _outbox_wakeup.set()
+
+def start_outbox_dispatcher():
+    """Start de outbox dispatcher precies één keer per proces"""
+    global _outbox_thread
+    with _outbox_thread_lock:
+        if _outbox_thread is None or not _outbox_thread.is_alive():
+            _outbox_thread = Thread(target=run_outbox, args=(_outbox_wakeup, _outbox_stop), name="outbox-dispatcher")
+            _outbox_thread.daemon = True
+            _outbox_thread.start()
+            print("Outbox dispatcher gestart")
+        return _outbox_thread
+
+def load_recent_completions(email, limit=10):
+    """Laatste afrondingen van een leverancier met hun verzendstatus"""
+    with db_connection() as conn:
+        return conn.execute("""
+        SELECT o.job_id, k.naam, o.naar_status, o.status, o.pogingen, o.laatste_fout, o.aangemaakt_op
+        FROM completion_outbox o
+        LEFT JOIN klanten k ON k.id = o.klant_id
+        WHERE o.email = ?
+        ORDER BY o.id DESC
+        LIMIT ?
+        """, (email, limit)).fetchall()
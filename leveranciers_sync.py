@@ -0,0 +1,879 @@
+import hashlib
+import json
+import time
+import datetime
+import os
+import re
+import socket
+import uuid
+import argparse
+import signal
+import sys
+from threading import Thread, Lock, Event
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from dotenv import load_dotenv
+
+from ultimo_client import get_client
+from portal_db import (
+    db_connection, close_connection, init_db, bump_generation, split_job_document, store_references,
+    encode_document
+)
+from job_outbox import start_outbox_dispatcher, stop_outbox_dispatcher
+
+# Load environment variables
+load_dotenv()
+
+# IMPROVED SYNC SYSTEM - Single consolidated function
+def trigger_sync():
+    """Improved sync trigger that doesn't require re-login"""
+    try:
+        with db_connection() as conn:
+            c = conn.cursor()
+            
+            # Check if sync is already in progress
+            c.execute("SELECT sync_in_progress FROM sync_control WHERE id = 1")
+            result = c.fetchone()
+            
+            if result and result[0]:
+                return False, "Sync already in progress"
+            
+            # Set sync in progress and force sync flags
+            c.execute("UPDATE sync_control SET force_sync = 1, sync_in_progress = 1 WHERE id = 1")
+        
+        # Wek de sync worker direct in plaats van te wachten op de volgende ronde
+        get_sync_wakeup().set()
+        return True, "Sync started"
+    except Exception as e:
+        return False, f"Error starting sync: {str(e)}"
+
+def get_sync_status():
+    """Get current sync status without triggering a rerun"""
+    try:
+        with db_connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT sync_in_progress, last_sync, sync_interval FROM sync_control WHERE id = 1")
+            result = c.fetchone()
+        
+        if result:
+            sync_in_progress, last_sync, sync_interval = result
+            return {
+                'in_progress': bool(sync_in_progress),
+                'last_sync': last_sync,
+                'interval': sync_interval
+            }
+        
+        return {'in_progress': False, 'last_sync': None, 'interval': 3600}
+    except:
+        return {'in_progress': False, 'last_sync': None, 'interval': 3600}
+
+# PAGINATED JOB FETCH - Bounded memory per customer
+JOB_EXPAND = "Vendor/ObjectContacts/Employee,Equipment,ProcessFunction"
+DEFAULT_PAGE_SIZE = 500
+MIN_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 2000
+TARGET_PAGE_SECONDS = 3.0
+
+def adapt_page_size(page_size, elapsed):
+    """Pas de paginagrootte aan op basis van de responstijd van de vorige pagina"""
+    if elapsed > TARGET_PAGE_SECONDS:
+        return max(MIN_PAGE_SIZE, page_size // 2)
+    if elapsed < TARGET_PAGE_SECONDS / 4:
+        return min(MAX_PAGE_SIZE, int(page_size * 1.5))
+    return page_size
+
+def fetch_job_pages(domein, api_key, filter_query, page_size, deadline=None, select=None, after=None):
+    """Haal jobs pagina voor pagina op, oplopend op (RecordChangeDate, Id).
+    
+    Keyset paging: elke pagina begint na de laatste job van de vorige in plaats van op een
+    skip offset, zodat een job die tijdens het ophalen wijzigt geen andere jobs laat verschuiven.
+    `after` is een optioneel (RecordChangeDate, Id) startpunt. Met `select` worden alleen die
+    velden opgehaald, zonder uitgeklapte relaties; RecordChangeDate en Id zijn nodig om te bladeren.
+    """
+    client = get_client(domein, api_key)
+    page_size = min(MAX_PAGE_SIZE, max(MIN_PAGE_SIZE, page_size or DEFAULT_PAGE_SIZE))
+    cursor = after or (None, None)
+    
+    while True:
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError(f"Sync van {domein} duurt langer dan toegestaan")
+        
+        params = {
+            "orderby": "RecordChangeDate,Id",
+            "top": page_size
+        }
+        if select:
+            params["select"] = select
+        else:
+            params["expand"] = JOB_EXPAND
+        page_filter = combine_filters(build_change_filter(*cursor), filter_query)
+        if page_filter:
+            params["filter"] = page_filter
+        
+        started = time.monotonic()
+        try:
+            response = client.get("object/Job", params=params)
+        except requests.exceptions.Timeout:
+            # Timeout: probeer dezelfde pagina opnieuw met een kleinere paginagrootte
+            if page_size > MIN_PAGE_SIZE:
+                page_size = max(MIN_PAGE_SIZE, page_size // 2)
+                print(f"Timeout bij {domein}, paginagrootte verlaagd naar {page_size}")
+                continue
+            raise
+        elapsed = time.monotonic() - started
+        
+        if response.status_code != 200:
+            raise RuntimeError(f"API-fout: {response.status_code}")
+        
+        jobs = response.json().get("items", [])
+        yield jobs
+        
+        if len(jobs) < page_size:
+            break
+        if not jobs[-1].get("RecordChangeDate"):
+            raise RuntimeError(f"Job {jobs[-1].get('Id')} zonder RecordChangeDate, verder bladeren is niet mogelijk")
+        cursor = (jobs[-1]["RecordChangeDate"], jobs[-1].get("Id", ""))
+        page_size = adapt_page_size(page_size, elapsed)
+
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", "500"))
+
+def job_cache_row(klant_id, job, document, now_str):
+    """Zet een Ultimo job om naar een jobs_cache rij; `document` is de job met verwijzingen (split_job_document)"""
+    job_id = job.get("Id", "")
+    omschrijving = job.get("Description", "")
+    voortgang_status = job.get("ProgressStatus", "")
+    wijzigingsdatum = job.get("RecordChangeDate")
+    
+    if not wijzigingsdatum:
+        wijzigingsdatum = now_str
+    
+    leverancier_id = ""
+    if "Vendor" in job and isinstance(job["Vendor"], dict):
+        leverancier_id = job["Vendor"].get("Id", "")
+    
+    apparatuur_omschrijving, apparatuur_id = "", None
+    if "Equipment" in job and isinstance(job["Equipment"], dict):
+        apparatuur_omschrijving = job["Equipment"].get("Description", "")
+        apparatuur_id = job["Equipment"].get("Id")
+    
+    processfunctie_omschrijving, processfunctie_id = "", None
+    if "ProcessFunction" in job and isinstance(job["ProcessFunction"], dict):
+        processfunctie_omschrijving = job["ProcessFunction"].get("Description", "")
+        processfunctie_id = job["ProcessFunction"].get("Id")
+    
+    return (
+        job_id, klant_id, omschrijving, apparatuur_omschrijving,
+        processfunctie_omschrijving, voortgang_status, leverancier_id,
+        wijzigingsdatum, encode_document(document), apparatuur_id, processfunctie_id
+    )
+
+def job_contact_rows(klant_id, job):
+    """Haal de (email, klant_id, job_id, naam, leverancier_id) rijen uit de uitgeklapte Vendor contacten"""
+    vendor = job.get("Vendor")
+    if not isinstance(vendor, dict):
+        return []
+    
+    rows = []
+    for contact in vendor.get("ObjectContacts") or []:
+        employee = contact.get("Employee") if isinstance(contact, dict) else None
+        if isinstance(employee, dict) and employee.get("EmailAddress"):
+            rows.append((employee["EmailAddress"], klant_id, job.get("Id", ""),
+                         employee.get("Description", ""), vendor.get("Id", "")))
+    return rows
+
+def job_content_hash(row, contacts):
+    """SHA-256 over de velden die de portal gebruikt.
+    
+    RecordChangeDate en de overige velden in `data` tellen niet mee: een job die
+    alleen op een ander veld gewijzigd is, hoeft niet herschreven te worden.
+    """
+    _, _, omschrijving, apparatuur, processfunctie, status, leverancier_id, _, _, apparatuur_id, processfunctie_id = row
+    relevant = [
+        omschrijving, apparatuur, processfunctie, status, leverancier_id, apparatuur_id, processfunctie_id,
+        sorted((email, naam or "") for email, _, _, naam, _ in contacts)
+    ]
+    return hashlib.sha256(json.dumps(relevant, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+def load_content_hashes(conn, klant_id, job_ids):
+    """Huidige inhoud_hash per job id voor één batch"""
+    placeholders = ", ".join("?" for _ in job_ids)
+    return dict(conn.execute(
+        f"SELECT id, inhoud_hash FROM jobs_cache WHERE klant_id = ? AND id IN ({placeholders})",
+        [klant_id] + list(job_ids)
+    ).fetchall())
+
+def store_jobs_page(conn, klant_id, jobs, now_str):
+    """Schrijf een pagina jobs in batches naar jobs_cache, referenties en job_contacts, één transactie per batch.
+    
+    Jobs waarvan de inhoud_hash niet veranderd is worden overgeslagen; gewijzigde jobs
+    worden ter plekke bijgewerkt in plaats van verwijderd en opnieuw ingevoegd.
+    Geeft (batch duur in seconden, aantal geschreven, aantal overgeslagen) terug.
+    """
+    batch_timings = []
+    written = skipped = 0
+    
+    for start in range(0, len(jobs), SYNC_BATCH_SIZE):
+        batch = jobs[start:start + SYNC_BATCH_SIZE]
+        started = time.monotonic()
+        try:
+            known_hashes = load_content_hashes(conn, klant_id, {job.get("Id", "") for job in batch})
+            
+            # Vendor, Employee, Equipment en ProcessFunction één keer opslaan, niet per job
+            rows, refs, contact_rows = [], [], []
+            for job in batch:
+                document, job_refs = split_job_document(job)
+                refs.extend(job_refs)
+                row = job_cache_row(klant_id, job, document, now_str)
+                contacts = job_contact_rows(klant_id, job)
+                inhoud_hash = job_content_hash(row, contacts)
+                if known_hashes.get(row[0]) == inhoud_hash:
+                    skipped += 1
+                    continue
+                rows.append(row + (inhoud_hash,))
+                contact_rows.extend(contacts)
+            store_references(conn, klant_id, refs, now_str)
+            
+            conn.executemany("""
+            INSERT INTO jobs_cache 
+            (id, klant_id, omschrijving, apparatuur_omschrijving, 
+            processfunctie_omschrijving, voortgang_status, leverancier_id, 
+            wijzigingsdatum, data, apparatuur_id, processfunctie_id, inhoud_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                klant_id = excluded.klant_id,
+                omschrijving = excluded.omschrijving,
+                apparatuur_omschrijving = excluded.apparatuur_omschrijving,
+                processfunctie_omschrijving = excluded.processfunctie_omschrijving,
+                voortgang_status = excluded.voortgang_status,
+                leverancier_id = excluded.leverancier_id,
+                wijzigingsdatum = excluded.wijzigingsdatum,
+                data = excluded.data,
+                apparatuur_id = excluded.apparatuur_id,
+                processfunctie_id = excluded.processfunctie_id,
+                inhoud_hash = excluded.inhoud_hash
+            """, rows)
+            
+            conn.executemany("DELETE FROM job_contacts WHERE klant_id = ? AND job_id = ?",
+                             [(klant_id, row[0]) for row in rows])
+            conn.executemany("""
+            INSERT OR IGNORE INTO job_contacts (email, klant_id, job_id, naam, leverancier_id)
+            VALUES (?, ?, ?, ?, ?)
+            """, contact_rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        batch_timings.append(time.monotonic() - started)
+        written += len(rows)
+    
+    return batch_timings, written, skipped
+
+# PROGRESS STATUS CATALOG - Local copy refreshed by sync, cached in-process
+STATUS_CATALOG_TTL = int(os.getenv("STATUS_CATALOG_TTL", "600"))
+STATUS_CATALOG_REFRESH = int(os.getenv("STATUS_CATALOG_REFRESH", "3600"))
+
+_status_catalog_cache = {}
+_status_catalog_lock = Lock()
+
+def fetch_progress_statuses(domein, api_key):
+    """Haal de ProgressStatus catalogus live op bij Ultimo"""
+    response = get_client(domein, api_key).get("object/ProgressStatus")
+    if response.status_code != 200:
+        raise RuntimeError(f"API-fout: {response.status_code}")
+    return response.json().get("items", [])
+
+def store_status_catalog(conn, klant_id, statuses, now_str):
+    """Vervang de lokale catalogus van een klant in één transactie"""
+    conn.execute("DELETE FROM voortgang_statussen WHERE klant_id = ?", (klant_id,))
+    conn.executemany(
+        "INSERT OR REPLACE INTO voortgang_statussen (klant_id, id, omschrijving, ververst_op) VALUES (?, ?, ?, ?)",
+        [(klant_id, status["Id"], status.get("Description"), now_str) for status in statuses if status.get("Id")]
+    )
+    conn.commit()
+    invalidate_status_catalog(klant_id)
+
+def refresh_status_catalog(conn, klant_id, domein, api_key, now_str, max_age=STATUS_CATALOG_REFRESH):
+    """Ververs de catalogus als die ontbreekt of ouder is dan `max_age` seconden"""
+    c = conn.cursor()
+    c.execute("SELECT MIN(ververst_op) FROM voortgang_statussen WHERE klant_id = ?", (klant_id,))
+    ververst_op = parse_sync_time(c.fetchone()[0])
+    now = parse_sync_time(now_str)
+    if ververst_op and now and (now - ververst_op).total_seconds() < max_age:
+        return False
+    
+    store_status_catalog(conn, klant_id, fetch_progress_statuses(domein, api_key), now_str)
+    return True
+
+def invalidate_status_catalog(klant_id=None):
+    """Vergeet de gecachte catalogus van één klant, of van alle klanten"""
+    with _status_catalog_lock:
+        if klant_id is None:
+            _status_catalog_cache.clear()
+        else:
+            _status_catalog_cache.pop(klant_id, None)
+
+def get_status_catalog(klant_id, domein=None, api_key=None):
+    """Geef de voortgangsstatussen van een klant als [{"Id", "Description"}].
+    
+    Leest uit de procescache (TTL), anders uit voortgang_statussen. Alleen als
+    de tabel nog leeg is en domein/api_key bekend zijn, wordt Ultimo bevraagd.
+    """
+    with _status_catalog_lock:
+        cached = _status_catalog_cache.get(klant_id)
+        if cached and time.monotonic() - cached[0] < STATUS_CATALOG_TTL:
+            return cached[1]
+    
+    with db_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT id, omschrijving FROM voortgang_statussen WHERE klant_id = ? ORDER BY id", (klant_id,))
+        statuses = [{"Id": row[0], "Description": row[1]} for row in c.fetchall()]
+        
+        if not statuses and domein and api_key:
+            try:
+                now_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                store_status_catalog(conn, klant_id, fetch_progress_statuses(domein, api_key), now_str)
+                c.execute("SELECT id, omschrijving FROM voortgang_statussen WHERE klant_id = ? ORDER BY id", (klant_id,))
+                statuses = [{"Id": row[0], "Description": row[1]} for row in c.fetchall()]
+            except Exception as e:
+                print(f"Fout bij het ophalen van voortgangsstatussen voor klant {klant_id}: {str(e)}")
+                return []
+    
+    with _status_catalog_lock:
+        _status_catalog_cache[klant_id] = (time.monotonic(), statuses)
+    return statuses
+
+# CONCURRENT SYNC WORKERS - One worker per customer
+SYNC_MAX_WORKERS = int(os.getenv("SYNC_MAX_WORKERS", "4"))
+SYNC_MAX_PER_DOMAIN = int(os.getenv("SYNC_MAX_PER_DOMAIN", "1"))
+SYNC_CUSTOMER_TIMEOUT = int(os.getenv("SYNC_CUSTOMER_TIMEOUT", "900"))
+
+def odata_string(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+def odata_datetime(value):
+    """RecordChangeDate zoals Ultimo hem teruggaf als OData literal, met volledige precisie"""
+    value = value.strip()
+    if value.endswith("Z") or re.search(r"[+-]\d\d:\d\d$", value):
+        return value
+    return value + "Z"
+
+def build_change_filter(watermark, watermark_id=None):
+    """Bouw het RecordChangeDate filter dat na (watermark, watermark_id) begint.
+    
+    Bij een gelijke RecordChangeDate beslist het Id, zodat jobs met dezelfde tijdstempel
+    als het startpunt niet wegvallen. Zonder Id telt de tijdstempel zelf mee; jobs die al
+    binnen waren worden dan door hun inhoud_hash overgeslagen.
+    """
+    if not watermark:
+        return None
+    formatted_date = odata_datetime(watermark)
+    if watermark_id is None:
+        return f"RecordChangeDate ge {formatted_date}"
+    return (f"RecordChangeDate gt {formatted_date} or "
+            f"(RecordChangeDate eq {formatted_date} and Id gt {odata_string(watermark_id)})")
+
+# SYNC FILTER - Only pull jobs the portal can show
+SYNC_RELEVANT_ONLY = os.getenv("SYNC_RELEVANT_ONLY", "1") != "0"
+
+def combine_filters(*parts):
+    """Combineer OData condities met 'and'; lege delen worden overgeslagen"""
+    parts = [part for part in parts if part]
+    if len(parts) <= 1:
+        return parts[0] if parts else None
+    return " and ".join(f"({part})" for part in parts)
+
+def build_relevance_filter():
+    """Jobs met een leverancier; alleen die kunnen contactpersonen (en dus portalgebruikers) hebben.
+    
+    De voortgangsstatus wordt bewust niet gefilterd: leveranciers zien ook jobs die (nog) niet
+    verwerkbaar zijn, en "verwerkbaar" wordt bij het lezen bepaald uit status_toewijzingen.
+    """
+    if not SYNC_RELEVANT_ONLY:
+        return None
+    return "Vendor ne null"
+
+def build_departure_filter():
+    """Het complement van build_relevance_filter: jobs waarvan de leverancier is weggehaald"""
+    if not SYNC_RELEVANT_ONLY:
+        return None
+    return "Vendor eq null"
+
+def remove_cached_jobs(conn, klant_id, job_ids):
+    """Verwijder jobs en hun contacten uit de cache; geeft het aantal verwijderde jobs terug"""
+    removed = 0
+    for start in range(0, len(job_ids), SYNC_BATCH_SIZE):
+        batch = [(klant_id, job_id) for job_id in job_ids[start:start + SYNC_BATCH_SIZE]]
+        conn.executemany("DELETE FROM job_contacts WHERE klant_id = ? AND job_id = ?", batch)
+        removed += conn.executemany("DELETE FROM jobs_cache WHERE klant_id = ? AND id = ?", batch).rowcount
+    return removed
+
+def apply_sync_filter(conn, klant_id, relevance):
+    """Vergelijk het relevantiefilter met dat van de vorige sync.
+    
+    Een lege of ontbrekende sync_filter betekent dat er ongefilterd is gesynchroniseerd.
+    Wordt het filter aangezet (versmallen), dan volstaat het lokaal opruimen van jobs zonder
+    leverancier. Alleen als het filter ruimer wordt, wordt de watermark gereset zodat de
+    ontbrekende jobs opnieuw worden opgehaald. Geeft True terug als de watermark gereset is.
+    """
+    signature = relevance or ""
+    row = conn.execute("SELECT sync_filter FROM sync_state WHERE klant_id = ?", (klant_id,)).fetchone()
+    previous = row[0] if row is not None and row[0] is not None else ""
+    if previous == signature:
+        return False
+    
+    if signature:
+        c = conn.execute("SELECT id FROM jobs_cache WHERE klant_id = ? AND leverancier_id = ''", (klant_id,))
+        removed = remove_cached_jobs(conn, klant_id, [job_id for job_id, in c.fetchall()])
+        print(f"Syncfilter van klant {klant_id} gewijzigd: {removed} jobs zonder leverancier verwijderd")
+    
+    # Alleen vanuit een ongefilterde sync is de nieuwe set al volledig lokaal aanwezig
+    widened = previous != ""
+    if widened:
+        print(f"Syncfilter van klant {klant_id} verruimd: alle jobs worden opnieuw opgehaald")
+        conn.execute("UPDATE sync_state SET watermark = NULL, watermark_id = NULL WHERE klant_id = ?", (klant_id,))
+    
+    conn.execute("UPDATE sync_state SET sync_filter = ? WHERE klant_id = ?", (signature, klant_id))
+    bump_generation(conn)
+    conn.commit()
+    return widened
+
+def sync_departed_jobs(conn, klant_id, domein, api_key, departure, deadline=None):
+    """Verwijder gecachte jobs die sinds de vertrek-watermark hun leverancier kwijt zijn.
+    
+    Vraagt alleen Id's op, zonder uitgeklapte relaties. De vertrek-watermark schuift pas
+    na een geslaagde controle op naar de job-watermark, zodat een afgebroken sync niets mist.
+    """
+    c = conn.execute("SELECT watermark, vertrek_watermark FROM sync_state WHERE klant_id = ?", (klant_id,))
+    watermark, vertrek_watermark = c.fetchone()
+    removed = 0
+    
+    if departure and vertrek_watermark:
+        for jobs in fetch_job_pages(domein, api_key, departure, MAX_PAGE_SIZE, deadline,
+                                    select="Id,RecordChangeDate", after=(vertrek_watermark, None)):
+            removed += remove_cached_jobs(conn, klant_id, [job["Id"] for job in jobs if job.get("Id")])
+    
+    conn.execute("""
+    UPDATE sync_state SET vertrek_watermark = COALESCE(?, vertrek_watermark)
+    WHERE klant_id = ?
+    """, (watermark, klant_id))
+    if removed:
+        bump_generation(conn)
+    conn.commit()
+    return removed
+
+def read_sync_watermark(conn, klant_id):
+    """Lees (watermark, watermark_id) van een klant; eenmalig afgeleid uit jobs_cache als er nog geen status is"""
+    c = conn.cursor()
+    c.execute("SELECT watermark, watermark_id FROM sync_state WHERE klant_id = ?", (klant_id,))
+    result = c.fetchone()
+    if result:
+        return result
+    
+    c.execute("SELECT MAX(wijzigingsdatum) FROM jobs_cache WHERE klant_id = ?", (klant_id,))
+    watermark = c.fetchone()[0]
+    c.execute("INSERT OR IGNORE INTO sync_state (klant_id, watermark, vertrek_watermark) VALUES (?, ?, ?)",
+              (klant_id, watermark, watermark))
+    conn.commit()
+    return watermark, None
+
+def advance_sync_watermark(conn, klant_id, jobs):
+    """Schuif de watermark op naar de laatste (RecordChangeDate, Id) van een weggeschreven pagina.
+    
+    Pagina's komen via keyset paging strikt oplopend binnen, dus de laatste job is het hervatpunt.
+    """
+    last = next((job for job in reversed(jobs) if job.get("RecordChangeDate")), None)
+    if last is None:
+        return
+    conn.execute("UPDATE sync_state SET watermark = ?, watermark_id = ? WHERE klant_id = ?",
+                 (last["RecordChangeDate"], last.get("Id", ""), klant_id))
+    conn.commit()
+
+def record_sync_result(conn, klant_id, now_str, error=None):
+    """Leg de laatste geslaagde run of de laatste fout van een klant vast"""
+    if error is None:
+        conn.execute("UPDATE sync_state SET last_success = ?, last_error = NULL WHERE klant_id = ?",
+                     (now_str, klant_id))
+    else:
+        conn.execute("UPDATE sync_state SET last_error = ?, last_error_at = ? WHERE klant_id = ?",
+                     (error, now_str, klant_id))
+    conn.commit()
+
+def sync_customer(klant, now_str):
+    """Synchroniseer de jobs van één klant op de verbinding van de worker thread"""
+    klant_id, klant_naam, domein, api_key, page_size = klant
+    result = {
+        "klant_id": klant_id, "klant_naam": klant_naam,
+        "jobs": 0, "written": 0, "skipped": 0, "removed": 0, "pages": 0, "batches": 0,
+        "write_seconds": 0.0, "slowest_batch_seconds": 0.0
+    }
+    started = time.monotonic()
+    
+    with db_connection() as conn:
+        deadline = time.monotonic() + SYNC_CUSTOMER_TIMEOUT
+        
+        try:
+            watermark, watermark_id = read_sync_watermark(conn, klant_id)
+            relevance = build_relevance_filter()
+            if apply_sync_filter(conn, klant_id, relevance):
+                watermark, watermark_id = None, None
+            
+            # Pagina's zijn oplopend gesorteerd; na elke weggeschreven pagina
+            # schuift de watermark op zodat een afgebroken sync daar hervat
+            for jobs in fetch_job_pages(domein, api_key, relevance, page_size, deadline, after=(watermark, watermark_id)):
+                changes_before = conn.total_changes
+                batch_timings, written, skipped = store_jobs_page(conn, klant_id, jobs, now_str)
+                # Ophogen in dezelfde commit als de watermark: de UI ziet elke pagina direct.
+                # Een pagina zonder gewijzigde jobs of referenties laat de caches staan.
+                if conn.total_changes != changes_before:
+                    bump_generation(conn)
+                advance_sync_watermark(conn, klant_id, jobs)
+                result["jobs"] += len(jobs)
+                result["written"] += written
+                result["skipped"] += skipped
+                result["pages"] += 1
+                result["batches"] += len(batch_timings)
+                result["write_seconds"] += sum(batch_timings)
+                result["slowest_batch_seconds"] = max([result["slowest_batch_seconds"]] + batch_timings)
+            
+            result["removed"] = sync_departed_jobs(conn, klant_id, domein, api_key,
+                                                   build_departure_filter(), deadline)
+            
+            # Een mislukte catalogus-refresh mag de job sync niet laten falen
+            catalog_refreshed = False
+            try:
+                catalog_refreshed = refresh_status_catalog(conn, klant_id, domein, api_key, now_str)
+            except Exception as e:
+                conn.rollback()
+                print(f"Fout bij het verversen van voortgangsstatussen voor klant {klant_id}: {str(e)}")
+            
+            if catalog_refreshed:
+                bump_generation(conn)
+            record_sync_result(conn, klant_id, now_str)
+        except Exception as e:
+            conn.rollback()
+            record_sync_result(conn, klant_id, now_str, str(e))
+            raise
+    
+    result["seconds"] = round(time.monotonic() - started, 3)
+    result["write_seconds"] = round(result["write_seconds"], 3)
+    result["slowest_batch_seconds"] = round(result["slowest_batch_seconds"], 3)
+    print(f"Klant {klant_id}: {result['jobs']} jobs in {result['batches']} batches, "
+          f"{result['written']} geschreven, {result['skipped']} ongewijzigd overgeslagen, "
+          f"{result['removed']} zonder leverancier verwijderd "
+          f"({result['write_seconds']}s schrijven, traagste batch {result['slowest_batch_seconds']}s)")
+    return result
+
+def sync_customer_worker(klant, now_str):
+    """sync_customer in een pool thread; de pool leeft één ronde, dus de verbinding daarna sluiten"""
+    try:
+        return sync_customer(klant, now_str)
+    finally:
+        close_connection()
+
+def run_sync_cycle(klanten, now_str, heartbeat=None):
+    """Synchroniseer alle klanten parallel; een falende klant blokkeert de rest niet.
+    
+    Per Ultimo domein lopen hooguit SYNC_MAX_PER_DOMAIN klanten tegelijk. Een klant wordt pas
+    ingediend als zijn domein ruimte heeft, zodat een wachtende klant nooit een worker bezet
+    houdt en klanten op andere domeinen niet achter een trage tenant aansluiten.
+    `heartbeat` wordt periodiek aangeroepen zolang er klanten lopen, zodat de sync lease verlengd blijft.
+    """
+    waiting = {}
+    for klant in klanten:
+        waiting.setdefault(klant[2], deque()).append(klant)
+    running = {domein: 0 for domein in waiting}
+    results = []
+    
+    with ThreadPoolExecutor(max_workers=SYNC_MAX_WORKERS, thread_name_prefix="sync") as executor:
+        futures = {}
+        
+        while True:
+            for domein, queue in waiting.items():
+                while queue and running[domein] < SYNC_MAX_PER_DOMAIN:
+                    klant = queue.popleft()
+                    running[domein] += 1
+                    futures[executor.submit(sync_customer_worker, klant, now_str)] = klant
+            if not futures:
+                break
+            
+            done, _ = wait(set(futures), timeout=SYNC_LEASE_SECONDS / 3)
+            for future in done:
+                klant_id, klant_naam, domein = futures.pop(future)[:3]
+                running[domein] -= 1
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    print(f"Fout bij het verwerken van jobs voor klant {klant_id}: {str(e)}")
+                    results.append({"klant_id": klant_id, "klant_naam": klant_naam, "error": str(e)})
+            if futures and heartbeat:
+                heartbeat()
+    
+    return results
+
+# EVENT-DRIVEN SYNC SCHEDULER - Sleeps until the next customer is due
+SYNC_MAX_SLEEP = int(os.getenv("SYNC_MAX_SLEEP", "300"))
+SYNC_LEASE_SECONDS = int(os.getenv("SYNC_LEASE_SECONDS", "180"))
+
+_sync_wakeup = Event()
+_sync_stop = Event()
+_sync_thread = None
+_sync_thread_lock = Lock()
+
+def get_sync_wakeup():
+    """Procesbreed event waarmee trigger_sync de sync worker direct wekt"""
+    return _sync_wakeup
+
+def parse_sync_time(value):
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+def plan_sync(klanten, now, force, attempted):
+    """Bepaal welke klanten nu aan de beurt zijn en wanneer de volgende klant due is.
+    
+    `klanten` bevat rijen (id, naam, domein, api_key, page_size, interval, last_success, last_error_at).
+    """
+    due = []
+    next_due = None
+    
+    for klant in klanten:
+        klant_id, interval, last_success, last_error_at = klant[0], klant[5], klant[6], klant[7]
+        attempts = [t for t in (parse_sync_time(last_success), parse_sync_time(last_error_at),
+                                attempted.get(klant_id)) if t is not None]
+        due_at = max(attempts) + datetime.timedelta(seconds=interval) if attempts else now
+        
+        if force or due_at <= now:
+            due.append(klant[:5])
+        elif next_due is None or due_at < next_due:
+            next_due = due_at
+    
+    return due, next_due
+
+def acquire_sync_lease(conn, owner):
+    """Claim of verleng de sync lease; slechts één proces per database synchroniseert"""
+    now = datetime.datetime.now()
+    expires = now + datetime.timedelta(seconds=SYNC_LEASE_SECONDS)
+    c = conn.cursor()
+    c.execute("""
+    UPDATE sync_control SET lease_owner = ?, lease_expires = ?
+    WHERE id = 1 AND (lease_owner IS NULL OR lease_owner = ? OR lease_expires < ?)
+    """, (owner, expires.isoformat(), owner, now.isoformat()))
+    conn.commit()
+    return c.rowcount == 1
+
+def release_sync_lease(conn, owner):
+    conn.execute("UPDATE sync_control SET lease_owner = NULL, lease_expires = NULL WHERE id = 1 AND lease_owner = ?",
+                 (owner,))
+    conn.commit()
+
+def new_lease_owner():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def load_sync_customers(c, sync_interval, klant_ids=None):
+    """Haal de klanten met hun interval en laatste syncmomenten op, eventueel beperkt tot klant_ids"""
+    # Klanten zonder eigen interval volgen het globale sync_interval
+    c.execute("""
+    SELECT k.id, k.naam, k.domein, k.api_key, k.page_size,
+           COALESCE(k.sync_interval, ?), s.last_success, s.last_error_at
+    FROM klanten k
+    LEFT JOIN sync_state s ON s.klant_id = k.id
+    """, (sync_interval,))
+    klanten = c.fetchall()
+    if klant_ids:
+        klanten = [klant for klant in klanten if klant[0] in klant_ids]
+    return klanten
+
+def build_sync_summary(started, results):
+    """Machine-leesbare samenvatting van één syncronde"""
+    finished = datetime.datetime.now()
+    return {
+        "started": started.isoformat(timespec="seconds"),
+        "finished": finished.isoformat(timespec="seconds"),
+        "seconds": round((finished - started).total_seconds(), 3),
+        "klanten": len(results),
+        "jobs": sum(result.get("jobs", 0) for result in results),
+        "written": sum(result.get("written", 0) for result in results),
+        "skipped": sum(result.get("skipped", 0) for result in results),
+        "removed": sum(result.get("removed", 0) for result in results),
+        "errors": sum(1 for result in results if "error" in result),
+        "results": results
+    }
+
+def sync_jobs(wakeup=None, stop=None, klant_ids=None, on_cycle=None):
+    """Langlopende sync scheduler; `on_cycle` krijgt na elke ronde de samenvatting.
+    
+    De sync lease wordt alleen tijdens een ronde vastgehouden (en via de heartbeat
+    verlengd); tussen rondes slaapt de scheduler tot de volgende klant due is.
+    """
+    wakeup = wakeup or Event()
+    stop = stop or Event()
+    attempted = {}
+    owner = new_lease_owner()
+    
+    while not stop.is_set():
+        wait_seconds = SYNC_MAX_SLEEP
+        holds_lease = False
+        
+        try:
+            now = datetime.datetime.now()
+            now_str = now.strftime("%Y-%m-%d %H:%M:%S")
+            
+            with db_connection() as conn:
+                c = conn.cursor()
+                
+                c.execute("SELECT force_sync, sync_interval FROM sync_control WHERE id = 1")
+                result = c.fetchone()
+                
+                if result:
+                    force_sync_flag, sync_interval = result
+                else:
+                    force_sync_flag = False
+                    sync_interval = 3600
+                    c.execute("INSERT INTO sync_control (id, force_sync, last_sync, sync_interval, sync_in_progress) VALUES (1, 0, NULL, 3600, 0)")
+                    conn.commit()
+                
+                klanten = load_sync_customers(c, sync_interval, klant_ids)
+                due, next_due = plan_sync(klanten, now, force_sync_flag, attempted)
+                
+                if due or force_sync_flag:
+                    # Zonder lease synchroniseert een ander proces; na SYNC_MAX_SLEEP opnieuw proberen
+                    holds_lease = acquire_sync_lease(conn, owner)
+                elif next_due is not None:
+                    # Niets te doen: geen lease nodig, slapen tot de volgende klant due is
+                    wait_seconds = min(SYNC_MAX_SLEEP, max(1, (next_due - now).total_seconds()))
+                
+                if holds_lease:
+                    if force_sync_flag:
+                        c.execute("UPDATE sync_control SET force_sync = 0 WHERE id = 1")
+                        print("Forced sync triggered")
+                    
+                    # Opnieuw plannen met de lease: een ander proces kan net een ronde afgerond hebben
+                    klanten = load_sync_customers(c, sync_interval, klant_ids)
+                    due, next_due = plan_sync(klanten, now, force_sync_flag, attempted)
+                    
+                    c.execute("UPDATE sync_control SET sync_in_progress = 1 WHERE id = 1")
+                    conn.commit()
+                    
+                    # Sync due customers concurrently, each committing on its own
+                    results = run_sync_cycle(due, now_str, heartbeat=lambda: acquire_sync_lease(conn, owner))
+                    for klant in due:
+                        attempted[klant[0]] = now
+                    
+                    c.execute("UPDATE sync_control SET last_sync = ?, sync_in_progress = 0 WHERE id = 1", (now_str,))
+                    conn.commit()
+                    release_sync_lease(conn, owner)
+                    holds_lease = False
+                    print(f"Sync completed at {now_str} ({len(due)} klanten)")
+                    if on_cycle:
+                        on_cycle(build_sync_summary(now, results))
+                    wait_seconds = 0
+        
+        except Exception as e:
+            print(f"Sync thread fout: {str(e)}")
+            wait_seconds = 60
+            # Make sure to clear sync_in_progress flag and the lease on error
+            if holds_lease:
+                try:
+                    with db_connection() as conn:
+                        conn.execute("UPDATE sync_control SET sync_in_progress = 0 WHERE id = 1")
+                        release_sync_lease(conn, owner)
+                except:
+                    pass
+        
+        # Slaap tot de volgende klant due is, of tot trigger_sync ons wekt
+        if wait_seconds:
+            wakeup.wait(wait_seconds)
+        wakeup.clear()
+    
+    try:
+        with db_connection() as conn:
+            release_sync_lease(conn, owner)
+    except Exception as e:
+        print(f"Fout bij het vrijgeven van de sync lease: {str(e)}")
+
+def run_sync_once(klant_ids=None):
+    """Voer één volledige syncronde uit voor alle (of de gekozen) klanten en geef de samenvatting terug"""
+    started = datetime.datetime.now()
+    now_str = started.strftime("%Y-%m-%d %H:%M:%S")
+    owner = new_lease_owner()
+    
+    with db_connection() as conn:
+        c = conn.cursor()
+        
+        if not acquire_sync_lease(conn, owner):
+            c.execute("SELECT lease_owner FROM sync_control WHERE id = 1")
+            return {"started": started.isoformat(timespec="seconds"), "skipped": "lease",
+                    "lease_owner": c.fetchone()[0]}
+        
+        try:
+            c.execute("SELECT sync_interval FROM sync_control WHERE id = 1")
+            klanten = load_sync_customers(c, c.fetchone()[0], klant_ids)
+            
+            c.execute("UPDATE sync_control SET sync_in_progress = 1 WHERE id = 1")
+            conn.commit()
+            
+            results = run_sync_cycle([klant[:5] for klant in klanten], now_str,
+                                     heartbeat=lambda: acquire_sync_lease(conn, owner))
+            
+            c.execute("UPDATE sync_control SET last_sync = ?, sync_in_progress = 0 WHERE id = 1", (now_str,))
+            conn.commit()
+        finally:
+            c.execute("UPDATE sync_control SET sync_in_progress = 0 WHERE id = 1")
+            conn.commit()
+            release_sync_lease(conn, owner)
+    
+    return build_sync_summary(started, results)
+
+def start_sync_thread():
+    """Start de sync worker precies één keer per proces, ongeacht sessies en reruns"""
+    global _sync_thread
+    with _sync_thread_lock:
+        if _sync_thread is None or not _sync_thread.is_alive():
+            _sync_thread = Thread(target=sync_jobs, args=(_sync_wakeup, _sync_stop), name="sync-scheduler")
+            _sync_thread.daemon = True
+            _sync_thread.start()
+            print("Sync thread gestart")
+        return _sync_thread
+
+# HEADLESS ENTRY POINT - Cron (--once) or systemd (long-running)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Synchroniseer Ultimo jobs naar de Leveranciers Portal database")
+    parser.add_argument("--once", action="store_true", help="Voer één syncronde uit en stop (voor cron)")
+    parser.add_argument("--klant", type=int, action="append", dest="klant_ids", metavar="ID",
+                        help="Synchroniseer alleen deze klant (herhaalbaar)")
+    args = parser.parse_args(argv)
+    
+    # Logregels gaan naar stderr zodat stdout alleen JSON samenvattingen bevat
+    summary_out = sys.stdout
+    sys.stdout = sys.stderr
+    
+    def emit(summary):
+        summary_out.write(json.dumps(summary) + "\n")
+        summary_out.flush()
+    
+    init_db()
+    
+    if args.once:
+        summary = run_sync_once(args.klant_ids)
+        emit(summary)
+        return 1 if summary.get("errors") else 0
+    
+    def shutdown(signum, frame):
+        _sync_stop.set()
+        _sync_wakeup.set()
+        stop_outbox_dispatcher()
+    
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    # De daemon verstuurt ook openstaande afrondingen, ook als de UI niet draait
+    start_outbox_dispatcher()
+    sync_jobs(_sync_wakeup, _sync_stop, args.klant_ids, on_cycle=emit)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,4 @@
 import streamlit as st
-import requests
 import json
 import pandas as pd
 import sqlite3
@@ -8,8 +7,10 @@ import os
 import random
 import string
 from datetime import datetime, timezone
+from ultimo_client import get_client
 
-# Database setup
+# Database setup (eenmaal per proces, niet bij elke rerun)
+@st.cache_resource
 def init_db():
     conn = sqlite3.connect('portal.db')
     c = conn.cursor()
@@ -59,42 +60,38 @@ def init_db():
     conn.close()
 
 # API functies
+STATUS_CATALOG_TTL = int(os.getenv("STATUS_CATALOG_TTL", "600"))
+
+@st.cache_data(ttl=STATUS_CATALOG_TTL, show_spinner=False)
+def fetch_progress_statuses(domain, api_key):
+    """Statuscatalogus per domein; fouten worden niet gecached"""
+    response = get_client(domain, api_key).get("object/ProgressStatus")
+    
+    if response.status_code != 200:
+        raise RuntimeError(f"API Fout: {response.status_code} - {response.text}")
+        
+    data = response.json()
+    if not isinstance(data, dict) or 'items' not in data:
+        raise RuntimeError("Ongeldige API respons structuur")
+        
+    return data.get('items', [])
+
 def get_progress_statuses(domain, api_key):
-    url = f"https://{domain}/api/v1/object/ProgressStatus"
-    headers = {
-        'accept': 'application/json',
-        'ApiKey': api_key
-    }
     try:
-        response = requests.get(url, headers=headers)
-        
-        if response.status_code != 200:
-            st.error(f"API Fout: {response.status_code} - {response.text}")
-            return []
-            
-        data = response.json()
-        if not isinstance(data, dict) or 'items' not in data:
-            st.error("Ongeldige API respons structuur")
-            return []
-            
-        return data.get('items', [])
+        return fetch_progress_statuses(domain, api_key)
     except Exception as e:
         st.error(f"Fout bij ophalen statussen: {str(e)}")
         return []
 
 def get_jobs_for_vendor(domain, api_key, email):
-    url = f"https://{domain}/api/v1/object/Job"
-    headers = {
-        'accept': 'application/json',
-        'ApiKey': api_key
-    }
+    client = get_client(domain, api_key)
     
     params = {
         'expand': 'Vendor/ObjectContacts/Employee'
     }
     
     try:
-        response = requests.get(url, headers=headers, params=params)
+        response = client.get("object/Job", params=params)
         
         if response.status_code != 200:
             st.error(f"API Fout: {response.status_code} - {response.text}")
@@ -135,16 +132,14 @@ def get_jobs_for_vendor(domain, api_key, email):
                 if employee.get('EmailAddress') == email:
                     try:
                         if 'Equipment' in job and job['Equipment']:
-                            equip_url = f"https://{domain}/api/v1/object/Equipment('{job['Equipment']}')"
-                            equip_response = requests.get(equip_url, headers=headers)
+                            equip_response = client.get(f"object/Equipment('{job['Equipment']}')")
                             if equip_response.status_code == 200:
                                 job['Equipment'] = equip_response.json()
                             else:
                                 st.warning(f"Fout bij ophalen Equipment details voor {job['Equipment']}: {equip_response.status_code} - {equip_response.text}")
                             
                         if 'ProcessFunction' in job and job['ProcessFunction']:
-                            proc_url = f"https://{domain}/api/v1/object/ProcessFunction('{job['ProcessFunction']}')"
-                            proc_response = requests.get(proc_url, headers=headers)
+                            proc_response = client.get(f"object/ProcessFunction('{job['ProcessFunction']}')")
                             if proc_response.status_code == 200:
                                 job['ProcessFunction'] = proc_response.json()
                             else:
@@ -165,8 +160,8 @@ def get_jobs_for_vendor(domain, api_key, email):
     
 def update_job_status(domain, api_key, job_id, feedback_text, new_progress_status):
     # Gebruik de door de API verwachte URL-syntaxis voor de job
-    job_url = f"https://{domain}/api/v1/object/Job('{job_id}')"
-    st.write("DEBUG: PATCH URL:", job_url)
+    job_path = f"object/Job('{job_id}')"
+    st.write("DEBUG: PATCH URL:", f"https://{domain}/api/v1/{job_path}")
     
     # Stel StatusCompletedDate in op de huidige datum/tijd in ISO-formaat (UTC)
     status_completed_date = datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
@@ -180,14 +175,8 @@ def update_job_status(domain, api_key, job_id, feedback_text, new_progress_statu
     
     st.write("DEBUG: PATCH Payload:", payload)
     
-    headers = {
-        'accept': 'application/json',
-        'ApiKey': api_key,
-        'Content-Type': 'application/json'
-    }
-    
     try:
-        response = requests.patch(job_url, headers=headers, json=payload)
+        response = get_client(domain, api_key).patch(job_path, json=payload)
         st.write("DEBUG: PATCH Response status:", response.status_code)
         st.write("DEBUG: PATCH Response body:", response.text)
         response.raise_for_status()
@@ -200,12 +189,8 @@ def attach_image_to_job(domain, api_key, job_id, image_file):
     """
     Verzendt een base64-gecodeerde afbeelding naar de API om deze aan een job te koppelen.
     """
-    url = f"https://{domain}/api/v1/action/REST_AttachImageToJob"
     headers = {
-        'accept': 'application/json',
-        'ApplicationElementId': 'D1FB01D577C248DFB95A2ADA578578DF',
-        'ApiKey': api_key,
-        'Content-Type': 'application/json'
+        'ApplicationElementId': 'D1FB01D577C248DFB95A2ADA578578DF'
     }
     
     try:
@@ -225,7 +210,7 @@ def attach_image_to_job(domain, api_key, job_id, image_file):
             "ImageFileBase64Extension": extension
         }
         
-        response = requests.post(url, headers=headers, json=payload)
+        response = get_client(domain, api_key).post("action/REST_AttachImageToJob", headers=headers, json=payload)
         response.raise_for_status()
         return True
     except Exception as e:
@@ -0,0 +1,507 @@
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+DB_PATH = os.getenv("PORTAL_DB_PATH", "leveranciers_portal.db")
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "30000"))
+MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+READ_MODEL_CACHE_SIZE = int(os.getenv("READ_MODEL_CACHE_SIZE", "256"))
+
+_local = threading.local()
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+def get_connection():
+    """Geef de herbruikbare verbinding van deze thread, met WAL en afgestemde pragmas"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000)
+        # WAL laat de sync thread schrijven terwijl de UI blijft lezen
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        _local.conn = conn
+    return conn
+
+@contextmanager
+def db_connection():
+    """Context manager rond de thread-verbinding: commit bij succes, rollback bij een fout"""
+    conn = get_connection()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+def close_connection():
+    """Sluit de verbinding van deze thread (bijv. aan het einde van een worker thread)"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+# REFERENCE ENTITIES - Vendor/Employee/Equipment/ProcessFunction stored once per customer
+def encode_document(document):
+    """Compacte, stabiele JSON zodat ongewijzigde documenten byte-gelijk blijven"""
+    return json.dumps(document, sort_keys=True, separators=(",", ":"))
+
+def is_expanded(value):
+    """Een uitgeklapte entiteit: een dict met een Id én meer velden dan alleen dat Id"""
+    return isinstance(value, dict) and bool(value.get("Id")) and len(value) > 1
+
+def split_job_document(job):
+    """Splits een uitgeklapte job in een compact document en de losse referentie-entiteiten.
+    
+    Uitgeklapte entiteiten worden vervangen door {"Id": ...}; contactpersonen van de Vendor
+    verwijzen op dezelfde manier naar hun Employee. Geeft (document, [(entiteit, id, data)]) terug.
+    Een verwijzing die al alleen een Id bevat blijft staan en is geen referentie, zodat een
+    genormaliseerd document de opgeslagen entiteit nooit overschrijft.
+    """
+    document = dict(job)
+    refs = []
+    
+    for entiteit in ("Equipment", "ProcessFunction"):
+        value = job.get(entiteit)
+        if is_expanded(value):
+            refs.append((entiteit, value["Id"], value))
+            document[entiteit] = {"Id": value["Id"]}
+    
+    vendor = job.get("Vendor")
+    if is_expanded(vendor):
+        vendor = dict(vendor)
+        if isinstance(vendor.get("ObjectContacts"), list):
+            contacts = []
+            for contact in vendor["ObjectContacts"]:
+                employee = contact.get("Employee") if isinstance(contact, dict) else None
+                if is_expanded(employee):
+                    refs.append(("Employee", employee["Id"], employee))
+                    contact = dict(contact, Employee={"Id": employee["Id"]})
+                contacts.append(contact)
+            vendor["ObjectContacts"] = contacts
+        refs.append(("Vendor", vendor["Id"], vendor))
+        document["Vendor"] = {"Id": vendor["Id"]}
+    
+    return document, refs
+
+def store_references(conn, klant_id, refs, now_str):
+    """Upsert referentie-entiteiten; ongewijzigde rijen worden niet herschreven"""
+    unique = {(entiteit, ref_id): encode_document(data) for entiteit, ref_id, data in refs}
+    conn.executemany("""
+    INSERT INTO referenties (klant_id, entiteit, id, data, bijgewerkt_op)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (klant_id, entiteit, id) DO UPDATE
+    SET data = excluded.data, bijgewerkt_op = excluded.bijgewerkt_op
+    WHERE referenties.data != excluded.data
+    """, [(klant_id, entiteit, ref_id, data, now_str) for (entiteit, ref_id), data in unique.items()])
+
+def load_reference(conn, klant_id, entiteit, ref_id):
+    row = conn.execute("SELECT data FROM referenties WHERE klant_id = ? AND entiteit = ? AND id = ?",
+                       (klant_id, entiteit, ref_id)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def build_job_document(conn, klant_id, job_id):
+    """Bouw het volledige, uitgeklapte job document opnieuw op uit jobs_cache en referenties"""
+    row = conn.execute("SELECT data FROM jobs_cache WHERE id = ? AND klant_id = ?", (job_id, klant_id)).fetchone()
+    if not row:
+        return None
+    document = json.loads(row[0])
+    
+    for entiteit in ("Equipment", "ProcessFunction", "Vendor"):
+        stub = document.get(entiteit)
+        if isinstance(stub, dict) and stub.get("Id"):
+            document[entiteit] = load_reference(conn, klant_id, entiteit, stub["Id"]) or stub
+    
+    vendor = document.get("Vendor")
+    if isinstance(vendor, dict) and isinstance(vendor.get("ObjectContacts"), list):
+        for contact in vendor["ObjectContacts"]:
+            employee = contact.get("Employee") if isinstance(contact, dict) else None
+            if isinstance(employee, dict) and employee.get("Id"):
+                contact["Employee"] = load_reference(conn, klant_id, "Employee", employee["Id"]) or employee
+    
+    return document
+
+# SCHEMA MIGRATIONS - Ordered, idempotent steps tracked in PRAGMA user_version
+def add_column_if_missing(conn, table, column, definition):
+    """Voeg een kolom toe als die nog niet bestaat"""
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        print(f"Adding {column} column to {table} table...")
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def migrate_base_schema(conn):
+    """Basisschema; ook veilig op databases van voor de migraties"""
+    c = conn.cursor()
+    
+    # Maak klanten tabel (Ultimo ERP systemen)
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS klanten (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        naam TEXT NOT NULL,
+        domein TEXT NOT NULL,
+        api_key TEXT NOT NULL
+    )
+    ''')
+    add_column_if_missing(conn, "klanten", "sync_interval", "INTEGER")
+    add_column_if_missing(conn, "klanten", "page_size", "INTEGER")
+    
+    # Maak voortgangsstatus-toewijzingen tabel
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS status_toewijzingen (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        klant_id INTEGER NOT NULL,
+        van_status TEXT NOT NULL,
+        naar_status TEXT NOT NULL,
+        FOREIGN KEY (klant_id) REFERENCES klanten (id)
+    )
+    ''')
+    
+    # Maak jobs cache tabel
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS jobs_cache (
+        id TEXT PRIMARY KEY,
+        klant_id INTEGER NOT NULL,
+        omschrijving TEXT NOT NULL,
+        apparatuur_omschrijving TEXT,
+        processfunctie_omschrijving TEXT,
+        voortgang_status TEXT NOT NULL,
+        leverancier_id TEXT NOT NULL,
+        wijzigingsdatum TEXT NOT NULL,
+        data JSON NOT NULL,
+        FOREIGN KEY (klant_id) REFERENCES klanten (id)
+    )
+    ''')
+    
+    # Maak inlogcodes tabel
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS inlogcodes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT NOT NULL,
+        code TEXT NOT NULL,
+        aangemaakt_op TEXT NOT NULL,
+        gebruikt BOOLEAN NOT NULL DEFAULT 0
+    )
+    ''')
+    
+    # Maak email verificatie cache tabel
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS email_verification_cache (
+        email TEXT PRIMARY KEY,
+        verified BOOLEAN NOT NULL,
+        timestamp TEXT NOT NULL
+    )
+    ''')
+    
+    # Maak sync control tabel (backwards compatible)
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS sync_control (
+        id INTEGER PRIMARY KEY,
+        force_sync BOOLEAN NOT NULL DEFAULT 0,
+        last_sync TEXT,
+        sync_interval INTEGER NOT NULL DEFAULT 3600
+    )
+    ''')
+    add_column_if_missing(conn, "sync_control", "sync_in_progress", "BOOLEAN NOT NULL DEFAULT 0")
+    add_column_if_missing(conn, "sync_control", "lease_owner", "TEXT")
+    add_column_if_missing(conn, "sync_control", "lease_expires", "TEXT")
+    
+    # Maak sync status per klant tabel (watermark voor incrementele sync)
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS sync_state (
+        klant_id INTEGER PRIMARY KEY,
+        watermark TEXT,
+        last_success TEXT,
+        last_error TEXT,
+        last_error_at TEXT,
+        FOREIGN KEY (klant_id) REFERENCES klanten (id)
+    )
+    ''')
+    
+    # Maak job contacten tabel (e-mail -> job index, gevuld door de sync)
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'job_contacts'")
+    job_contacts_exists = c.fetchone() is not None
+    
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS job_contacts (
+        email TEXT NOT NULL,
+        klant_id INTEGER NOT NULL,
+        job_id TEXT NOT NULL,
+        naam TEXT,
+        leverancier_id TEXT,
+        PRIMARY KEY (email, klant_id, job_id)
+    )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_job_contacts_job ON job_contacts (klant_id, job_id)")
+    
+    if not job_contacts_exists:
+        # Eenmalig vullen vanuit de bestaande jobs_cache
+        print("Building job_contacts index from jobs_cache...")
+        c.execute("""
+        INSERT OR IGNORE INTO job_contacts (email, klant_id, job_id, naam, leverancier_id)
+        SELECT json_extract(oc.value, '$.Employee.EmailAddress'), jc.klant_id, jc.id,
+               json_extract(oc.value, '$.Employee.Description'), jc.leverancier_id
+        FROM jobs_cache jc, json_each(jc.data, '$.Vendor.ObjectContacts') oc
+        WHERE json_extract(oc.value, '$.Employee.EmailAddress') IS NOT NULL
+          AND json_extract(oc.value, '$.Employee.EmailAddress') != ''
+        """)
+    
+    # Voeg standaard sync instellingen toe als ze nog niet bestaan
+    c.execute("INSERT OR IGNORE INTO sync_control (id, force_sync, last_sync, sync_interval, sync_in_progress) VALUES (1, 0, NULL, 3600, 0)")
+
+def migrate_hot_path_indexes(conn):
+    """Indexen voor de filters die bij elke rerun en sync draaien"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_status_toewijzingen_klant_van ON status_toewijzingen (klant_id, van_status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_inlogcodes_email_code ON inlogcodes (email, code, aangemaakt_op)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_cache_klant_status ON jobs_cache (klant_id, voortgang_status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_cache_klant_wijziging ON jobs_cache (klant_id, wijzigingsdatum)")
+
+def migrate_status_catalog(conn):
+    """Lokale kopie van de ProgressStatus catalogus per klant"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS voortgang_statussen (
+        klant_id INTEGER NOT NULL,
+        id TEXT NOT NULL,
+        omschrijving TEXT,
+        ververst_op TEXT NOT NULL,
+        PRIMARY KEY (klant_id, id),
+        FOREIGN KEY (klant_id) REFERENCES klanten (id)
+    )
+    ''')
+
+def migrate_cache_generation(conn):
+    """Generatieteller waarop de read-model cache invalideert"""
+    add_column_if_missing(conn, "sync_control", "generatie", "INTEGER NOT NULL DEFAULT 0")
+
+def migrate_completion_outbox(conn):
+    """Outbox voor afrondingen die nog naar Ultimo moeten"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS completion_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        idempotentie_sleutel TEXT NOT NULL,
+        klant_id INTEGER NOT NULL,
+        job_id TEXT NOT NULL,
+        van_status TEXT NOT NULL,
+        naar_status TEXT NOT NULL,
+        feedback TEXT,
+        email TEXT,
+        status TEXT NOT NULL DEFAULT 'wachtend',
+        pogingen INTEGER NOT NULL DEFAULT 0,
+        volgende_poging TEXT NOT NULL,
+        geclaimd_door TEXT,
+        geclaimd_tot TEXT,
+        laatste_fout TEXT,
+        aangemaakt_op TEXT NOT NULL,
+        verzonden_op TEXT,
+        FOREIGN KEY (klant_id) REFERENCES klanten (id)
+    )
+    ''')
+    # Eén openstaande afronding per sleutel; een dubbele klik wordt zo genegeerd
+    conn.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_completion_outbox_open
+    ON completion_outbox (idempotentie_sleutel) WHERE status IN ('wachtend', 'bezig')
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_completion_outbox_due ON completion_outbox (status, volgende_poging)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_completion_outbox_email ON completion_outbox (email, id)")
+
+def migrate_job_attachments(conn):
+    """Hashes van geüploade bijlagen, zodat dezelfde inhoud niet opnieuw verstuurd wordt"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS job_bijlagen (
+        klant_id INTEGER NOT NULL,
+        job_id TEXT NOT NULL,
+        sha256 TEXT NOT NULL,
+        soort TEXT NOT NULL,
+        bestandsnaam TEXT,
+        grootte INTEGER,
+        geupload_op TEXT NOT NULL,
+        PRIMARY KEY (klant_id, job_id, sha256)
+    )
+    ''')
+
+def migrate_reference_entities(conn):
+    """Referentie-entiteiten uit jobs_cache.data halen en per klant eenmalig opslaan"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS referenties (
+        klant_id INTEGER NOT NULL,
+        entiteit TEXT NOT NULL,
+        id TEXT NOT NULL,
+        data JSON NOT NULL,
+        bijgewerkt_op TEXT NOT NULL,
+        PRIMARY KEY (klant_id, entiteit, id)
+    )
+    ''')
+    add_column_if_missing(conn, "jobs_cache", "apparatuur_id", "TEXT")
+    add_column_if_missing(conn, "jobs_cache", "processfunctie_id", "TEXT")
+    
+    # Bestaande rijen in blokken omzetten (rowid-volgorde, zodat er niets dubbel gelezen wordt)
+    now_str = time.strftime("%Y-%m-%d %H:%M:%S")
+    last_rowid = 0
+    while True:
+        rows = conn.execute("""
+        SELECT rowid, id, klant_id, data FROM jobs_cache WHERE rowid > ? ORDER BY rowid LIMIT 500
+        """, (last_rowid,)).fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1][0]
+        
+        updates = []
+        for rowid, job_id, klant_id, data in rows:
+            document, refs = split_job_document(json.loads(data))
+            store_references(conn, klant_id, refs, now_str)
+            updates.append((encode_document(document), (document.get("Equipment") or {}).get("Id"),
+                            (document.get("ProcessFunction") or {}).get("Id"), rowid))
+        conn.executemany("""
+        UPDATE jobs_cache SET data = ?, apparatuur_id = ?, processfunctie_id = ? WHERE rowid = ?
+        """, updates)
+
+def migrate_job_content_hash(conn):
+    """Hash van de portal-velden per job, zodat de sync ongewijzigde jobs kan overslaan"""
+    # Bestaande rijen houden NULL en worden bij hun eerstvolgende sync één keer herschreven
+    add_column_if_missing(conn, "jobs_cache", "inhoud_hash", "TEXT")
+
+def migrate_sync_filter(conn):
+    """Relevantiefilter per klant en een aparte watermark voor jobs die uit de relevante set vallen"""
+    add_column_if_missing(conn, "sync_state", "sync_filter", "TEXT")
+    add_column_if_missing(conn, "sync_state", "vertrek_watermark", "TEXT")
+    # Alles tot de huidige watermark is ongefilterd gesynchroniseerd en dus actueel; dat
+    # vastleggen voorkomt dat de eerste sync na de upgrade alles opnieuw ophaalt
+    conn.execute("UPDATE sync_state SET vertrek_watermark = watermark WHERE vertrek_watermark IS NULL")
+    conn.execute("UPDATE sync_state SET sync_filter = '' WHERE sync_filter IS NULL")
+
+def migrate_sync_keyset(conn):
+    """Id bij de watermark, zodat een sync binnen een gedeelde RecordChangeDate kan hervatten"""
+    # Bestaande watermarks zonder Id hervatten inclusief hun eigen tijdstempel
+    add_column_if_missing(conn, "sync_state", "watermark_id", "TEXT")
+
+def migrate_outbox_previous_feedback(conn):
+    """FeedbackText van de job vóór de afronding, om die bij een mislukte afronding terug te zetten"""
+    add_column_if_missing(conn, "completion_outbox", "vorige_feedback", "TEXT")
+
+# (versie, omschrijving, stap) - alleen toevoegen, nooit hernummeren
+MIGRATIONS = [
+    (1, "basisschema", migrate_base_schema),
+    (2, "indexen voor veelgebruikte queries", migrate_hot_path_indexes),
+    (3, "voortgangsstatus catalogus", migrate_status_catalog),
+    (4, "cache generatie", migrate_cache_generation),
+    (5, "outbox voor afrondingen", migrate_completion_outbox),
+    (6, "bijlagen per job", migrate_job_attachments),
+    (7, "referentie-entiteiten", migrate_reference_entities),
+    (8, "inhoud hash per job", migrate_job_content_hash),
+    (9, "syncfilter per klant", migrate_sync_filter),
+    (10, "watermark met Id", migrate_sync_keyset),
+    (11, "vorige feedback in outbox", migrate_outbox_previous_feedback),
+]
+
+def run_migrations(conn):
+    """Voer alle migraties boven de huidige user_version uit, elk in een eigen transactie.
+    
+    Elke stap neemt met BEGIN IMMEDIATE direct het schrijfslot en leest user_version daarna
+    opnieuw, zodat twee processen (UI en daemon) die tegelijk starten een stap nooit allebei
+    uitvoeren. Geeft per uitgevoerde migratie (versie, omschrijving, seconden) terug.
+    """
+    report = []
+    
+    for version, beschrijving, migrate in MIGRATIONS:
+        if version <= conn.execute("PRAGMA user_version").fetchone()[0]:
+            continue
+        
+        started = time.monotonic()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Een ander proces kan deze stap al uitgevoerd hebben terwijl we op het slot wachtten
+            if version <= conn.execute("PRAGMA user_version").fetchone()[0]:
+                conn.rollback()
+                continue
+            migrate(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        
+        elapsed = time.monotonic() - started
+        print(f"Migratie {version} ({beschrijving}) uitgevoerd in {elapsed:.2f}s")
+        report.append((version, beschrijving, round(elapsed, 3)))
+    
+    return report
+
+# Database setup with migration support
+def init_db():
+    with db_connection() as conn:
+        return run_migrations(conn)
+
+def ensure_schema():
+    """Zorg eenmaal per proces dat het schema actueel is; daarna kost een aanroep niets"""
+    global _schema_ready
+    if _schema_ready:
+        return
+    
+    with _schema_lock:
+        if _schema_ready:
+            return
+        
+        with db_connection() as conn:
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+        # Alleen migreren (met schrijftransactie) als er iets openstaat
+        if current < MIGRATIONS[-1][0]:
+            init_db()
+        _schema_ready = True
+
+# READ-MODEL CACHE - Query results reused across reruns until the generation changes
+_read_model_cache = OrderedDict()
+_read_model_lock = threading.Lock()
+
+def get_generation(conn):
+    """Huidige generatie; wordt opgehoogd door sync en beheerwijzigingen"""
+    row = conn.execute("SELECT generatie FROM sync_control WHERE id = 1").fetchone()
+    return row[0] if row else 0
+
+def bump_generation(conn):
+    """Markeer alle read models als verouderd; de aanroeper commit"""
+    conn.execute("UPDATE sync_control SET generatie = generatie + 1 WHERE id = 1")
+
+def read_model(func):
+    """Cache `func(conn, *args)` per (naam, args) zolang de generatie gelijk blijft.
+    
+    Resultaten met een copy() (DataFrames, lijsten, dicts) worden als kopie
+    teruggegeven zodat een aanroeper de gecachte versie niet kan wijzigen.
+    De cache houdt maximaal READ_MODEL_CACHE_SIZE resultaten; de minst recent
+    gebruikte valt eruit (zoektermen en paginanummers maken veel sleutels).
+    """
+    @functools.wraps(func)
+    def wrapper(*args):
+        key = (func.__module__, func.__name__, args)
+        with db_connection() as conn:
+            generation = get_generation(conn)
+            with _read_model_lock:
+                entry = _read_model_cache.get(key)
+                if entry is not None:
+                    _read_model_cache.move_to_end(key)
+            
+            if entry is None or entry[0] != generation:
+                entry = (generation, func(conn, *args))
+                with _read_model_lock:
+                    # Resultaten van oudere generaties worden nooit meer gelezen
+                    for stale_key in [k for k, v in _read_model_cache.items() if v[0] < generation]:
+                        del _read_model_cache[stale_key]
+                    _read_model_cache[key] = entry
+                    _read_model_cache.move_to_end(key)
+                    while len(_read_model_cache) > READ_MODEL_CACHE_SIZE:
+                        _read_model_cache.popitem(last=False)
+        
+        value = entry[1]
+        return value.copy() if hasattr(value, "copy") else value
+    return wrapper
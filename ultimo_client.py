@@ -0,0 +1,58 @@
+import os
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Standaard timeouts (connect, read) voor alle Ultimo aanroepen
+DEFAULT_TIMEOUT = (
+    float(os.getenv("ULTIMO_CONNECT_TIMEOUT", "5")),
+    float(os.getenv("ULTIMO_READ_TIMEOUT", "30"))
+)
+POOL_SIZE = int(os.getenv("ULTIMO_POOL_SIZE", "10"))
+
+class UltimoClient:
+    """Ultimo REST client met een keep-alive sessie en connection pool per domein"""
+
+    def __init__(self, domein, api_key, timeout=DEFAULT_TIMEOUT, pool_size=POOL_SIZE):
+        self.domein = domein
+        self.base_url = f"https://{domein}/api/v1"
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "accept": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+            "ApiKey": api_key
+        })
+
+    def request(self, method, path, timeout=None, **kwargs):
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        return self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request("PATCH", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+_clients = {}
+_clients_lock = Lock()
+
+def get_client(domein, api_key):
+    """Geef de gedeelde client voor dit domein terug zodat TLS-verbindingen hergebruikt worden"""
+    key = (domein, api_key)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = UltimoClient(domein, api_key)
+            _clients[key] = client
+        return client